@@ -26,9 +26,10 @@ def main():
     parser.add_argument("--query", type=str, help="Search the codebase using natural language")
     parser.add_argument("--web", action="store_true", help="Launch the modern web interface")
     parser.add_argument("--port", type=int, default=5000, help="Port for the web server")
+    parser.add_argument("--check", action="store_true", help="Check the index database for corruption and exit")
     args = parser.parse_args()
 
-    should_launch_web = args.web or (not args.query and len(os.sys.argv) <= 2)
+    should_launch_web = args.web or (not args.query and not args.check and len(os.sys.argv) <= 2)
 
     setup_logging(args.verbose)
     
@@ -46,6 +47,13 @@ def main():
         return
 
     indexer.initialize_storage()
+
+    if args.check:
+        if indexer.sqlite.check_integrity():
+            print("Index database is healthy.")
+        else:
+            print("\n[!] Index database check failed, see the log for details.")
+        return
     
     if args.query:
         from src.model.orchestrator import get_orchestrator
@@ -53,7 +61,7 @@ def main():
         searcher = SearchManager(indexer, orchestrator=orchestrator)
         
         # Check if indexed
-        if searcher.chroma.collection.count() == 0:
+        if not searcher.is_indexed():
             print("\n[!] The codebase has not been indexed yet. Please run indexing first by running 'python main.py' without the --query argument.")
             return
 
@@ -91,11 +99,11 @@ def main():
         return
 
     snippets = indexer.extract_snippets()
-    relationships = indexer.extract_relationships(snippets)
+    relationships_future = indexer.extract_relationships_async(snippets)
     
     indexer.summarize_snippets(snippets)
     embeddings = indexer.embed_snippets(snippets)
-    indexer.save(snippets, relationships, embeddings=embeddings)
+    indexer.save(snippets, relationships_future.result(), embeddings=embeddings)
     indexer.cleanup(snippets)
 
     indexer.verify()
@@ -1,7 +1,8 @@
 from dataclasses import dataclass, field
 from typing import Dict, Optional, Any
 from enum import Enum
-import json
+import hashlib
+import orjson
 
 class SnippetType(Enum):
     FUNCTION = "function"
@@ -24,7 +25,7 @@ class RelationType(Enum):
     MODIFIES = "modifies"
     INSTANTIATES = "instantiates"
 
-@dataclass
+@dataclass(slots=True)
 class CodeSnippet:
     id: str
     name: str
@@ -41,12 +42,41 @@ class CodeSnippet:
     end_byte: Optional[int] = None
     is_skeleton: bool = False
     metadata: Dict[str, Any] = field(default_factory=dict)
+    _embed_text_cache: Dict[bool, tuple] = field(default_factory=dict, init=False, repr=False, compare=False)
+    _content_hash: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def content_hash(self) -> str:
+        """Hash of the snippet content, computed once and reused by dedup/cache lookups."""
+        if self._content_hash is None:
+            self._content_hash = hashlib.blake2b(self.content.encode("utf-8"), digest_size=16).hexdigest()
+        return self._content_hash
+
+    @property
+    def embeddable_text(self) -> str:
+        """The memoized summary-including embeddable text, as stored in ChromaDB and fed to the reranker."""
+        return self.to_embeddable_text(use_summary=True)
 
     def to_embeddable_text(self, use_summary: bool = True) -> str:
         """
         Constructs a string representation of the snippet for embedding and retrieval.
         Includes metadata like file path and name to provide more context.
+        The result is memoized; the key covers every mutable input so a new summary invalidates it.
         """
+        key = (
+            self.name,
+            self.content,
+            self.summary,
+            self.metadata.get("parent_signature"),
+            self.metadata.get("parent_summary"),
+        )
+        cached = self._embed_text_cache.get(use_summary)
+        if cached is None or cached[0] != key:
+            cached = (key, self._build_embeddable_text(use_summary))
+            self._embed_text_cache[use_summary] = cached
+        return cached[1]
+
+    def _build_embeddable_text(self, use_summary: bool) -> str:
         file_info = f"File: {self.file_path}\n" if self.file_path else ""
         name_info = f"Name: {self.name}\n" if self.name else ""
         type_info = f"Type: {self.type.value}\n"
@@ -82,7 +112,7 @@ class CodeSnippet:
     def __repr__(self):
         return self.__str__()
 
-@dataclass
+@dataclass(slots=True)
 class Relationship:
     source_id: str
     target_id: str
@@ -90,7 +120,7 @@ class Relationship:
     metadata: Dict[str, Any] = field(default_factory=dict)
 
     def to_tuple(self):
-        return (self.source_id, self.target_id, self.type.value, json.dumps(self.metadata) if self.metadata else None)
+        return (self.source_id, self.target_id, self.type.value, orjson.dumps(self.metadata).decode() if self.metadata else None)
 
     def __str__(self):
         return f"({self.source_id[:8]}...) --[{self.type.value.upper()}]--> ({self.target_id[:8]}...)"
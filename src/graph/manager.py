@@ -48,11 +48,12 @@ class GraphManager:
                 continue
 
             # Get the tree and code from parser's cache (Optimization: No disk I/O in Pass 2)
-            tree = parser._tree_cache.get(file_path)
-            code = parser._code_cache.get(file_path)
+            cache_entry = parser.get_file_cache(file_path)
+            tree = cache_entry.tree
+            code = cache_entry.code
             
             if not tree or not code:
-                # Fallback to disk only if cache is missing (unlikely in 2-pass flow)
+                # Fallback to disk when Pass 1 did not parse in this process (e.g. parse_directory with processes)
                 try:
                     with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
                         code = f.read()
@@ -4,8 +4,10 @@ import logging
 import threading
 import queue
 from dataclasses import dataclass
-from typing import List, Optional, Dict, Any, Set
-from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import lru_cache
+from pathlib import Path, PurePath
+from typing import List, Optional, Dict, Any, Set, Tuple
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
 
 from tqdm import tqdm
 
@@ -20,6 +22,18 @@ from src.model.embedding import get_embedding_model
 
 logger = logging.getLogger(__name__)
 
+PROJECTS_ROOT = Path("data") / "projects"
+
+@lru_cache(maxsize=64)
+def project_id_for(path: str) -> str:
+    """
+    Stable project id for an absolute source path. The digest names the on-disk data directory,
+    so it must stay MD5 for existing indexes to be found; it is computed once per path.
+    """
+    folder_name = PurePath(path).name
+    path_hash = hashlib.md5(path.encode(), usedforsecurity=False).hexdigest()[:8]
+    return f"{folder_name}_{path_hash}"
+
 @dataclass
 class ProjectContext:
     src_path: str
@@ -50,20 +64,20 @@ class ProjectIndexer:
         
         self.changed_files: Set[str] = set()
         self.all_encountered_files: Dict[str, str] = {}
-        self._embedding_cache: Dict[str, Any] = {}
+        # (snippet id, content hash) -> embedding; ids only encode the byte range, so an edit that keeps it
+        # must not get the old vector back
+        self._embedding_cache: Dict[Tuple[str, str], Any] = {}
         self._embedding_queue: queue.Queue = queue.Queue()
 
     def _create_context(self, path: str) -> ProjectContext:
-        folder_name = os.path.basename(path.rstrip(os.sep))
-        path_hash = hashlib.md5(path.encode()).hexdigest()[:8]
-        project_id = f"{folder_name}_{path_hash}"
-        data_dir = os.path.join("data", "projects", project_id)
+        project_id = project_id_for(path)
+        data_dir = PROJECTS_ROOT / project_id
         
         return ProjectContext(
             src_path=path,
             project_id=project_id,
-            data_dir=data_dir,
-            sqlite_path=os.path.join(data_dir, "codebase.db")
+            data_dir=str(data_dir),
+            sqlite_path=str(data_dir / "codebase.db")
         )
 
     def initialize_storage(self):
@@ -86,6 +100,8 @@ class ProjectIndexer:
         logger.info(f"Pass 1: Extracting snippets from {self.src_path}")
         self.changed_files.clear()
         self.all_encountered_files.clear()
+        # Embeddings are only reused within a run (pipelined in Pass 3, collected in Pass 4)
+        self._embedding_cache.clear()
         
         def should_parse_callback(file_path: str, content_hash: str):
             self.all_encountered_files[file_path] = content_hash
@@ -99,6 +115,8 @@ class ProjectIndexer:
             self.changed_files.add(file_path)
             return None
 
+        # Parsed on threads rather than processes: the trees stay in this process's parser caches,
+        # where Pass 2 reads them instead of parsing every changed file a second time
         snippets = self.factory.parse_directory(
             self.src_path, 
             recursive=True, 
@@ -119,6 +137,13 @@ class ProjectIndexer:
         logger.info(f"Successfully extracted {len(relationships)} relationships")
         return relationships
 
+    def extract_relationships_async(self, snippets: List[CodeSnippet]) -> "Future[List[Relationship]]":
+        """Starts Pass 2 on a background thread so the CPU-bound graph build overlaps summarization and embedding."""
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="relationships")
+        future = executor.submit(self.extract_relationships, snippets)
+        executor.shutdown(wait=False)
+        return future
+
     def summarize_snippets(self, snippets: List[CodeSnippet], batch_size: int = 5, embed_batch_size: int = 1):
         """Pass 3: Generates semantic summaries and pipelines embeddings to the GPU."""
         
@@ -246,8 +271,9 @@ class ProjectIndexer:
         to_embed_indices = []
 
         for i, snippet in enumerate(snippets):
-            if snippet.id in self._embedding_cache:
-                results[i] = self._embedding_cache[snippet.id]
+            key = (snippet.id, snippet.content_hash)
+            if key in self._embedding_cache:
+                results[i] = self._embedding_cache[key]
             elif snippet.file_path in self.changed_files:
                 to_embed.append(snippet)
                 to_embed_indices.append(i)
@@ -258,7 +284,7 @@ class ProjectIndexer:
                 embeddings = self.embedding_model.embed_snippets(to_embed, batch_size=batch_size, use_summary=use_summary)
                 for idx, emb in zip(to_embed_indices, embeddings):
                     results[idx] = emb
-                    self._embedding_cache[snippets[idx].id] = emb
+                    self._embedding_cache[(snippets[idx].id, snippets[idx].content_hash)] = emb
             except Exception as e:
                 logger.error(f"Final embedding pass failed: {e}")
 
@@ -274,19 +300,23 @@ class ProjectIndexer:
             
         logger.info("Saving data to SQLite, FalkorDB, and ChromaDB...")
         
-        # Clean old data for changed files
-        for file_path in self.changed_files:
-            self.sqlite.delete_file_snippets(file_path)
-            self.graph_db.delete_file_data(file_path)
-            self.chroma.delete_file_snippets(file_path)
-
-        # Save snippets (Changed only)
+        changed = list(self.changed_files)
         changed_snippets = [s for s in snippets if s.file_path in self.changed_files]
-        if changed_snippets:
-            self.sqlite.save_snippets(changed_snippets)
-            self.graph_db.save_snippets(changed_snippets)
-            
-            if embeddings:
+
+        def save_sqlite():
+            # Swap in the snippets of changed files in one transaction; hashes wait for every store
+            self.sqlite.replace_files(changed, changed_snippets, {})
+
+        def save_graph():
+            self.graph_db.delete_files_bulk(changed)
+            if changed_snippets:
+                self.graph_db.save_snippets(changed_snippets)
+            # Always save all relationships for complete graph connectivity
+            self.graph_db.save_relationships(relationships)
+
+        def save_chroma():
+            self.chroma.delete_files_bulk(changed)
+            if changed_snippets and embeddings:
                 # Align embeddings with changed snippets
                 valid_pairs = [
                     (s, embeddings[i]) 
@@ -297,12 +327,15 @@ class ProjectIndexer:
                     v_snips, v_embs = zip(*valid_pairs)
                     self.chroma.save_snippets(list(v_snips), list(v_embs))
 
-        # Always save all relationships for complete graph connectivity
-        self.graph_db.save_relationships(relationships)
-        
-        # Save hashes
-        for f_path, c_hash in self.all_encountered_files.items():
-            self.sqlite.save_file_hash(f_path, c_hash)
+        # The three stores are independent, so their writes run concurrently, one thread per store
+        with ThreadPoolExecutor(max_workers=3, thread_name_prefix="save") as executor:
+            futures = [executor.submit(task) for task in (save_sqlite, save_graph, save_chroma)]
+        for future in futures:
+            future.result()
+
+        # Saved last, once every store holds the new data: a file whose hash is recorded is skipped
+        # as unchanged on the next run, so a failed write must leave it to be re-indexed
+        self.sqlite.save_file_hashes(self.all_encountered_files)
                 
         logger.info("Save completed successfully")
 
@@ -313,15 +346,19 @@ class ProjectIndexer:
 
         logger.info("Starting cleanup pass...")
         current_files = {s.file_path for s in current_snippets if s.file_path}
+        sqlite_removed = set(self.sqlite.get_all_file_paths()).difference(current_files)
+        graph_removed = set(self.graph_db.get_all_file_paths()).difference(current_files)
         
-        for storage, name in [(self.sqlite, "SQLite"), (self.graph_db, "FalkorDB"), (self.chroma, "ChromaDB")]:
-            stored_files = set(storage.get_all_file_paths())
-            for f in (stored_files - current_files):
-                logger.info(f"Removing deleted file from {name}: {f}")
-                if hasattr(storage, 'delete_file_data'):
-                    storage.delete_file_data(f)
-                else:
-                    storage.delete_file_snippets(f)
+        # ChromaDB can only list file paths by loading every snippet's metadata, so it follows SQLite,
+        # which is written alongside it
+        for storage, name, removed in [
+            (self.sqlite, "SQLite", sqlite_removed),
+            (self.graph_db, "FalkorDB", graph_removed),
+            (self.chroma, "ChromaDB", sqlite_removed),
+        ]:
+            if removed:
+                logger.info(f"Removing {len(removed)} deleted files from {name}: {sorted(removed)}")
+                storage.delete_files_bulk(list(removed))
 
     def verify(self):
         """Prints a summary of the current project state in storage."""
@@ -396,7 +433,7 @@ class ProjectIndexer:
             try:
                 embeddings = self.embedding_model.embed_snippets(batch, batch_size=len(batch))
                 for s, emb in zip(batch, embeddings):
-                    self._embedding_cache[s.id] = emb
+                    self._embedding_cache[(s.id, s.content_hash)] = emb
                 
                 if pbar is not None:
                     pbar.update(len(batch))
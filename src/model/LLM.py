@@ -1,9 +1,9 @@
 import logging
 import os
-import json
-import re
+import orjson
 from google import genai
 from google.genai import types
+from pydantic import BaseModel
 from typing import List, Dict, Generator
 from src.IR.models import CodeSnippet
 
@@ -34,13 +34,16 @@ For each component, provide a summary (under 3 sentences) focusing on:
 2. Key inputs/outputs.
 3. Side effects/dependencies.
 
-You MUST return your response as a valid JSON object where the keys are the IDs provided and the values are the technical summaries.
-Ensure all newlines in summaries are escaped as '\\n'.
+Return one entry per component, using the ID provided.
 
 Components to summarize:
 {components_json}
+"""
 
-JSON Output:"""
+class SnippetSummary(BaseModel):
+    """Structured-output schema for a single batch summary entry."""
+    id: str
+    summary: str
 
 class GeminiLLM:
     _instance = None
@@ -158,12 +161,14 @@ class GeminiLLM:
 
         try:
             logger.info(f"Batch summarizing {len(snippets)} snippets with {self.summarizer_model}...")
-            prompt = BATCH_SUMMARY_PROMPT.format(components_json=json.dumps(components, indent=2))
+            prompt = BATCH_SUMMARY_PROMPT.format(components_json=orjson.dumps(components).decode())
             
+            # The schema constrains decoding, so the response is always a valid list of entries
             config = types.GenerateContentConfig(
                 max_output_tokens=self.max_output_tokens,
                 temperature=0.0,
-                response_mime_type="application/json"
+                response_mime_type="application/json",
+                response_schema=list[SnippetSummary]
             )
             
             response = self.client.models.generate_content(
@@ -172,33 +177,14 @@ class GeminiLLM:
                 config=config
             )
             
-            response_text = self._clean_json_response(response.text)
-            if not response_text:
+            if not response.parsed:
+                logger.warning(f"Empty structured response for batch of {len(snippets)} snippets")
                 return
 
-            try:
-                results = json.loads(response_text)
-            except json.JSONDecodeError as je:
-                logger.warning(f"Failed to parse JSON directly. Attempting extraction. Error: {je}")
-                match = re.search(r"(\{.*\})", response_text, re.DOTALL)
-                if match:
-                    try:
-                        results = json.loads(match.group(1))
-                    except Exception:
-                        logger.error("Regex extraction failed.")
-                        return
-                else:
-                    return
-
+            results = {entry.id: entry.summary for entry in response.parsed}
             for s in snippets:
                 if s.id in results:
-                    val = results[s.id]
-                    if isinstance(val, dict):
-                        # If the LLM returned a JSON object instead of a string,
-                        # try to get a 'summary' or 'content' key, otherwise dump to string.
-                        s.summary = val.get("summary") or val.get("content") or json.dumps(val)
-                    else:
-                        s.summary = str(val) if val is not None else None
+                    s.summary = results[s.id]
         except Exception as e:
             logger.error(f"Error in batch summarization: {e}")
 
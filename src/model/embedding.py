@@ -2,6 +2,7 @@ import logging
 import numpy as np
 import torch
 import gc
+from dataclasses import dataclass
 from sentence_transformers import SentenceTransformer
 from transformers import BitsAndBytesConfig
 from typing import List, Union
@@ -9,6 +10,39 @@ from src.IR.models import CodeSnippet
 
 logger = logging.getLogger(__name__)
 
+# Largest magnitude of a symmetric int8 code
+INT8_MAX = 127
+
+@dataclass
+class QuantizedEmbeddings:
+    """Int8 embedding matrix with one scale per row. Rows can be used directly for cosine similarity."""
+    vectors: np.ndarray
+    scales: np.ndarray
+
+    def dequantize(self) -> np.ndarray:
+        """Returns the float32 approximation of the original embeddings for exact scoring passes."""
+        return self.vectors.astype(np.float32) * self.scales
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def __getitem__(self, idx):
+        return self.vectors[idx]
+
+    def __iter__(self):
+        return iter(self.vectors)
+
+def quantize_embeddings(embeddings: np.ndarray) -> QuantizedEmbeddings:
+    """
+    Quantizes float embeddings to int8 with a symmetric max-abs scale per row. Components of
+    unit-norm high-dimensional vectors are far below 1, so a fixed 1/127 scale would leave only a few levels.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    scales = np.abs(embeddings).max(axis=1, keepdims=True) / INT8_MAX
+    scales[scales == 0] = 1.0
+    q = np.clip(np.round(embeddings / scales), -INT8_MAX, INT8_MAX).astype(np.int8)
+    return QuantizedEmbeddings(vectors=q, scales=scales)
+
 class JinaEmbeddingModel:
     _instance = None
 
@@ -50,15 +84,15 @@ class JinaEmbeddingModel:
                         bnb_4bit_use_double_quant=True,
                     ),
                     "dtype": torch.float16,
-                    "attn_implementation": "eager",
+                    "attn_implementation": "sdpa",
                 }
             else:
                 logger.info(f"Loading {self.model_name} in float16 for GPU")
-                model_kwargs = {"dtype": torch.float16, "attn_implementation": "eager"}
+                model_kwargs = {"dtype": torch.float16, "attn_implementation": "sdpa"}
         else:
             device = "cpu"
             logger.info(f"Loading {self.model_name} on CPU (4-bit quantization via bitsandbytes is GPU-only, loading in float32)")
-            model_kwargs = {}
+            model_kwargs = {"attn_implementation": "eager"}
 
         try:
             self.model = SentenceTransformer(
@@ -73,9 +107,10 @@ class JinaEmbeddingModel:
             logger.error(f"Failed to load Jina Embedding model: {e}")
             raise
 
-    def embed_text(self, text: Union[str, List[str]], batch_size: int = 1) -> np.ndarray:
+    def embed_text(self, text: Union[str, List[str]], batch_size: int = 1, half_precision: bool = False) -> np.ndarray:
         """
         Generates embeddings for the given text or list of texts.
+        If half_precision is True, the result is a float16 array copied from the device in a single transfer.
         """
         self._load_model()
         try:
@@ -83,9 +118,12 @@ class JinaEmbeddingModel:
                 text, 
                 batch_size=batch_size, 
                 show_progress_bar=False,
-                convert_to_numpy=True,
+                convert_to_numpy=not half_precision,
+                convert_to_tensor=half_precision,
                 normalize_embeddings=True
             )
+            if half_precision:
+                return embeddings.to(dtype=torch.float16).cpu().numpy()
             return embeddings
         except Exception as e:
             logger.error(f"Error during embedding generation: {e}")
@@ -94,27 +132,33 @@ class JinaEmbeddingModel:
                 gc.collect()
             return np.array([])
 
-    def embed_snippets(self, snippets: List[CodeSnippet], batch_size: int = 1, use_summary: bool = False) -> List[np.ndarray]:
+    def embed_snippets(self, snippets: List[CodeSnippet], batch_size: int = 1, use_summary: bool = False, quantize: bool = False) -> Union[np.ndarray, QuantizedEmbeddings]:
         """
-        Batch embeds a list of CodeSnippet objects.
+        Batch embeds a list of CodeSnippet objects into a contiguous (N, D) float16 matrix.
         If use_summary is True, combines the summary and the code content.
         Otherwise uses only the code content.
+        If quantize is True, returns int8 vectors instead of float16 ones.
         """
         if not snippets:
-            return []
+            return np.empty((0, 0), dtype=np.float16)
             
-        texts = []
-        for s in snippets:
-            texts.append(s.to_embeddable_text(use_summary=use_summary))
+        texts = [s.to_embeddable_text(use_summary=use_summary) for s in snippets]
             
-        embeddings = self.embed_text(texts, batch_size=batch_size)
+        embeddings = self.embed_text(texts, batch_size=batch_size, half_precision=True)
         
         if len(embeddings) == 0:
             logger.warning(f"Embedding generation failed for {len(snippets)} snippets. Returning zero vectors.")
             dim = self.model.get_sentence_embedding_dimension() if self.model else 1536
-            return [np.zeros(dim) for _ in range(len(snippets))]
+            embeddings = np.zeros((len(snippets), dim), dtype=np.float16)
             
-        return [embeddings[i] for i in range(len(snippets))]
+        if quantize:
+            return quantize_embeddings(embeddings)
+            
+        return embeddings
+
+    def embed_snippets_list(self, snippets: List[CodeSnippet], batch_size: int = 1, use_summary: bool = False) -> List[np.ndarray]:
+        """Backward compatible variant of embed_snippets returning one row view per snippet."""
+        return list(self.embed_snippets(snippets, batch_size=batch_size, use_summary=use_summary))
 
     def clear_cache(self):
         """Manually clear CUDA cache and collect garbage."""
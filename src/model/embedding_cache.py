@@ -0,0 +1,94 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Query embeddings kept in memory (interactive sessions repeat and refine the same queries)
+EMBEDDING_CACHE_SIZE = 1024
+# Seconds an in-memory entry stays valid; the persistent tier has no expiry since embeddings are deterministic
+EMBEDDING_CACHE_TTL = 3600.0
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """Collapses whitespace so queries differing only in spacing share a cache entry."""
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class CachedEmbedder:
+    """
+    Wraps an embedding model with an in-memory LRU for query embeddings and an optional
+    persistent tier (a store exposing get_query_embedding / save_query_embedding, e.g. SQLiteStorage).
+    Every other attribute is forwarded to the wrapped model.
+    """
+
+    def __init__(self, model, store=None, capacity: int = EMBEDDING_CACHE_SIZE, ttl: Optional[float] = EMBEDDING_CACHE_TTL):
+        self._model = model
+        self._store = store
+        self._capacity = capacity
+        self._ttl = ttl
+        # (model name, normalized query) -> (insertion time, embedding)
+        self._cache: "OrderedDict[Tuple[str, str], Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if name == "_model":
+            raise AttributeError(name)
+        return getattr(self._model, name)
+
+    def embed_text(self, text: str) -> np.ndarray:
+        """
+        Returns the float32 embedding of a single query. Cached arrays are shared between callers,
+        so they are read-only. Failed (empty) embeddings are not cached so the next call retries.
+        """
+        normalized = normalize_query(text)
+        key = (self._model.model_name, normalized)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                if self._ttl is None or now - entry[0] < self._ttl:
+                    self._cache.move_to_end(key)
+                    return entry[1]
+                del self._cache[key]
+
+        query_hash = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        embedding = self._load_persisted(query_hash)
+        if embedding is None:
+            embedding = np.asarray(self._model.embed_text(normalized), dtype=np.float32)
+            if embedding.size == 0:
+                return embedding
+            self._persist(query_hash, embedding)
+        # Shared between searches, so it must not be modified in place
+        embedding.setflags(write=False)
+
+        with self._lock:
+            self._cache[key] = (now, embedding)
+            while len(self._cache) > self._capacity:
+                self._cache.popitem(last=False)
+        return embedding
+
+    def _load_persisted(self, query_hash: str) -> Optional[np.ndarray]:
+        if self._store is None:
+            return None
+        try:
+            return self._store.get_query_embedding(query_hash, self._model.model_name)
+        except Exception as e:
+            logger.error(f"Failed to read persisted query embedding: {e}")
+            return None
+
+    def _persist(self, query_hash: str, embedding: np.ndarray):
+        if self._store is None:
+            return
+        try:
+            self._store.save_query_embedding(query_hash, self._model.model_name, embedding)
+        except Exception as e:
+            logger.error(f"Failed to persist query embedding: {e}")
@@ -1,9 +1,23 @@
+import functools
 import logging
+import os
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+from openai import OpenAI
+from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig, LogitsProcessor, LogitsProcessorList
+from typing import List, Optional
 
 logger = logging.getLogger(__name__)
 
+class AllowedTokensLogitsProcessor(LogitsProcessor):
+    """Masks every logit except the allowed token ids, constraining generation to a fixed set of choices."""
+    def __init__(self, allowed_token_ids: List[int]):
+        self.allowed_token_ids = allowed_token_ids
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        mask = torch.full_like(scores, float("-inf"))
+        mask[:, self.allowed_token_ids] = 0
+        return scores + mask
+
 class GemmaLLM:
     _instance = None
 
@@ -13,20 +27,35 @@ class GemmaLLM:
             cls._instance._initialized = False
         return cls._instance
 
-    def __init__(self, model_id: str = "google/gemma-2-2b-it"):
+    def __init__(self, model_id: str = "google/gemma-2-2b-it", server_url: Optional[str] = None):
+        """
+        Loads Gemma in-process, or talks to an OpenAI-compatible server (vLLM, TGI) when
+        server_url or GEMMA_SERVER_URL is set, e.g. one started with:
+        vllm serve google/gemma-2-2b-it --quantization bitsandbytes --dtype bfloat16 --enable-prefix-caching
+        """
         if self._initialized:
             return
         
         self.model_id = model_id
+        self.server_url = server_url or os.getenv("GEMMA_SERVER_URL")
         self.tokenizer = None
         self.model = None
+        self.client = None
 
     def load(self):
         """Public method to force load the model."""
         self._load_model()
 
     def _load_model(self):
-        if self.model is not None:
+        if self.model is not None or self.client is not None:
+            return
+
+        if self.server_url:
+            # Only the tokenizer is needed locally, to resolve logit-bias token ids
+            logger.info(f"Using {self.model_id} served at {self.server_url}")
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_id)
+            self.client = OpenAI(base_url=self.server_url, api_key=os.getenv("GEMMA_SERVER_API_KEY", "EMPTY"))
+            self._initialized = True
             return
             
         # 4-bit quantization configuration
@@ -56,16 +85,20 @@ class GemmaLLM:
 
     def complete(self, prompt: str, max_new_tokens: int = 512, temperature: float = 0.1) -> str:
         self._load_model()
+        if self.client:
+            return self._remote_complete(prompt, max_new_tokens, temperature)
         try:
             inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
             
-            outputs = self.model.generate(
-                **inputs,
-                max_new_tokens=max_new_tokens,
-                temperature=temperature,
-                do_sample=temperature > 0,
-                pad_token_id=self.tokenizer.eos_token_id
-            )
+            # generate() only disables grad; inference_mode also skips version counters and view tracking
+            with torch.inference_mode():
+                outputs = self.model.generate(
+                    **inputs,
+                    max_new_tokens=max_new_tokens,
+                    temperature=temperature,
+                    do_sample=temperature > 0,
+                    pad_token_id=self.tokenizer.eos_token_id
+                )
             
             # Extract only the generated part
             input_length = inputs.input_ids.shape[1]
@@ -76,6 +109,52 @@ class GemmaLLM:
             logger.error(f"Error during Gemma completion: {e}")
             return ""
 
+    def classify(self, prompt: str, choices: List[str]) -> str:
+        """
+        Picks one of the single-token choices with a single greedy forward step.
+        Returns an empty string on failure.
+        """
+        self._load_model()
+        try:
+            choice_ids = [self.tokenizer.encode(c, add_special_tokens=False)[0] for c in choices]
+            if self.client:
+                answer = self._remote_complete(
+                    prompt, max_new_tokens=1, temperature=0.0,
+                    logit_bias={str(tid): 100 for tid in choice_ids}
+                )
+                return answer if answer in choices else ""
+
+            inputs = self.tokenizer(prompt, return_tensors="pt").to(self.model.device)
+            
+            with torch.inference_mode():
+                outputs = self.model.generate(
+                    **inputs,
+                    max_new_tokens=1,
+                    do_sample=False,
+                    logits_processor=LogitsProcessorList([AllowedTokensLogitsProcessor(choice_ids)]),
+                    pad_token_id=self.tokenizer.eos_token_id
+                )
+            
+            return choices[choice_ids.index(int(outputs[0][-1]))]
+        except Exception as e:
+            logger.error(f"Error during Gemma classification: {e}")
+            return ""
+
+    def _remote_complete(self, prompt: str, max_new_tokens: int, temperature: float, logit_bias: Optional[dict] = None) -> str:
+        """Runs a completion against the OpenAI-compatible server."""
+        try:
+            response = self.client.chat.completions.create(
+                model=self.model_id,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_new_tokens,
+                temperature=temperature,
+                logit_bias=logit_bias
+            )
+            return (response.choices[0].message.content or "").strip()
+        except Exception as e:
+            logger.error(f"Error during remote Gemma completion: {e}")
+            return ""
+
 HYDE_DECISION_PROMPT = """You are a technical assistant. Your task is to decide if a search query about a codebase would benefit from generating a hypothetical code snippet (HyDE).
 
 HyDE is useful for:
@@ -88,7 +167,7 @@ HyDE is NOT useful for:
 - Questions about project structure in general.
 - Questions that don't involve searching for specific code patterns.
 
-Respond with ONLY 'YES' if HyDE is beneficial, or 'NO' if it is not.
+Respond with ONLY 'Y' if HyDE is beneficial, or 'N' if it is not.
 
 Query: {query}
 
@@ -116,11 +195,11 @@ class Orchestrator:
         logger.info(f"Orchestrating query: {query}")
         
         decision_prompt = HYDE_DECISION_PROMPT.format(query=query)
-        decision = self.llm.complete(decision_prompt, max_new_tokens=5).upper() # Reduced tokens for decision
+        decision = self.llm.classify(decision_prompt, ["Y", "N"])
         
         logger.info(f"HyDE decision: {decision}")
         
-        if "YES" in decision:
+        if decision == "Y":
             logger.info("Generating hypothetical code (HyDE)...")
             gen_prompt = HYDE_GENERATION_PROMPT.format(query=query)
             # Reduced tokens for generation and added more direct instructions
@@ -133,5 +212,6 @@ class Orchestrator:
         logger.info("Skipping HyDE generation.")
         return query
 
+@functools.lru_cache(maxsize=1)
 def get_orchestrator():
     return Orchestrator()
@@ -1,10 +1,39 @@
+import contextlib
+import functools
 import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 import torch
 from transformers import AutoModelForSequenceClassification, AutoTokenizer, BitsAndBytesConfig
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Literal
 
 logger = logging.getLogger(__name__)
 
+# Maximum sequence length accepted by the reranker (query + document + special tokens)
+MAX_LENGTH = 1024
+# Documents are cut to this many characters before tokenization; code averages well under 4 characters
+# per token, so the cut only drops text the token truncation would discard anyway
+MAX_DOC_CHARS = MAX_LENGTH * 4
+# Upper bound on padded tokens per forward pass, keeps VRAM bounded regardless of document lengths
+BIN_TOKENS = 8192
+# Fixed sequence lengths used when the forward pass is compiled, so CUDA graphs are captured once per shape
+SHAPE_BUCKETS = (128, 256, 512, 1024)
+# Eager batches are padded to a multiple of this so matmul shapes stay tensor-core friendly
+PAD_MULTIPLE = 64
+# A bucket is closed once its longest pair would exceed its shortest padded length by this factor
+MAX_LENGTH_SPREAD = 1.2
+# FP32 matmul precision inside the reranker forward pass: residual FP32 matmuls (e.g. the classifier
+# head) run on TF32 tensor cores without changing the precision of the rest of the process
+FORWARD_MATMUL_PRECISION = "high"
+# Number of tokenized texts (queries and documents) kept across rerank calls
+TOKEN_CACHE_SIZE = 8192
+DEFAULT_BATCH_SIZE = 16
+# Int8 ONNX exports of the reranker, reused across runs so the export and quantization happen once
+ONNX_CACHE_DIR = Path("data") / "onnx"
+ONNX_QUANTIZED_FILE = "model_quantized.onnx"
+
 class JinaReranker:
     _instance = None
 
@@ -14,13 +43,26 @@ class JinaReranker:
             cls._instance._initialized = False
         return cls._instance
 
-    def __init__(self, model_id: str = "jinaai/jina-reranker-v2-base-multilingual"):
+    def __init__(self, model_id: str = "jinaai/jina-reranker-v2-base-multilingual", quantization: Literal["fp16", "int8", "fp8"] = "fp16"):
+        """
+        quantization selects the weight format on GPU: "fp16" (half precision, BF16 when supported),
+        "int8" (bitsandbytes weight-only) or "fp8" (FP8 tensor cores, compute capability 8.9+).
+        CPU runs a dynamically quantized int8 ONNX Runtime model when optimum is installed,
+        and the float32 PyTorch model otherwise.
+        """
         if self._initialized:
             return
         
         self.model_id = model_id
+        self.quantization = quantization
         self.tokenizer = None
         self.model = None
+        self._compiled = False
+        self._onnx = False
+        self._token_cache: "OrderedDict[str, List[int]]" = OrderedDict()
+        self._token_cache_lock = threading.Lock()
+        # Prepares the host tensors of the next bucket while the GPU runs the current one
+        self._prep_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reranker-prep")
 
     def load(self):
         """Public method to force load the model."""
@@ -30,27 +72,125 @@ class JinaReranker:
         if self.model is not None:
             return
 
-        logger.info(f"Loading {self.model_id} in float16...")
+        model_kwargs = self._precision_kwargs()
         
         try:
-            self.tokenizer = AutoTokenizer.from_pretrained(self.model_id, trust_remote_code=True)
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_id, trust_remote_code=True, use_fast=True)
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            if device == "cpu" and self._load_onnx_model():
+                self._initialized = True
+                logger.info("Jina Reranker loaded successfully (ONNX Runtime int8).")
+                return
+            if "quantization_config" in model_kwargs:
+                # Quantized weights are materialized directly on the target device
+                model_kwargs["device_map"] = {"": device}
+            
+            # A single-device cross-encoder does not need accelerate's dispatch hooks:
+            # memory-map the safetensors weights and move them over once
             self.model = AutoModelForSequenceClassification.from_pretrained(
                 self.model_id,
-                torch_dtype=torch.float16,
-                device_map="auto",
                 trust_remote_code=True,
+                attn_implementation="sdpa",
+                low_cpu_mem_usage=True,
+                use_safetensors=True,
+                **model_kwargs
             )
+            if "quantization_config" not in model_kwargs:
+                self.model = self.model.to(device, non_blocking=True)
             self.model.eval()
+            self._compile_model()
             self._initialized = True
             logger.info("Jina Reranker loaded successfully.")
         except Exception as e:
             logger.error(f"Failed to load Jina Reranker: {e}")
             raise
 
-    def rerank(self, query: str, documents: List[str], top_n: int = 5, batch_size: int = 16) -> List[Dict[str, Any]]:
+    def _load_onnx_model(self) -> bool:
+        """
+        Loads the int8 ONNX Runtime model for CPU inference, exporting and quantizing it on first use.
+        Returns False when optimum/onnxruntime are unavailable or the export fails, so the caller
+        falls back to the PyTorch model.
+        """
+        try:
+            import onnxruntime as ort
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            from optimum.onnxruntime import ORTModelForSequenceClassification
+        except ImportError:
+            logger.info("optimum[onnxruntime] not installed, reranking on CPU with the PyTorch model")
+            return False
+
+        export_dir = ONNX_CACHE_DIR / self.model_id.replace("/", "--")
+        quantized_path = export_dir / ONNX_QUANTIZED_FILE
+        try:
+            if not quantized_path.exists():
+                logger.info(f"Exporting {self.model_id} to ONNX and quantizing to int8...")
+                exported = ORTModelForSequenceClassification.from_pretrained(self.model_id, export=True, trust_remote_code=True)
+                exported.save_pretrained(export_dir)
+                quantize_dynamic(export_dir / "model.onnx", quantized_path, weight_type=QuantType.QInt8)
+
+            options = ort.SessionOptions()
+            # torch defaults to one thread per physical core, which is also the best fit for int8 GEMMs
+            options.intra_op_num_threads = torch.get_num_threads()
+            self.model = ORTModelForSequenceClassification.from_pretrained(
+                export_dir,
+                file_name=ONNX_QUANTIZED_FILE,
+                provider="CPUExecutionProvider",
+                session_options=options
+            )
+            self._onnx = True
+            return True
+        except Exception as e:
+            logger.warning(f"ONNX Runtime reranker unavailable, using the PyTorch model: {e}")
+            self.model = None
+            return False
+
+    def _precision_kwargs(self) -> Dict[str, Any]:
+        """Builds the from_pretrained dtype/quantization arguments for the selected precision."""
+        if not torch.cuda.is_available():
+            # bitsandbytes and half precision kernels are CUDA-only
+            logger.info(f"Loading {self.model_id} on CPU in float32...")
+            return {"torch_dtype": torch.float32}
+
+        if self.quantization == "int8":
+            logger.info(f"Loading {self.model_id} with int8 weights (bitsandbytes)...")
+            return {"quantization_config": BitsAndBytesConfig(load_in_8bit=True, llm_int8_threshold=6.0)}
+
+        if self.quantization == "fp8":
+            if torch.cuda.get_device_capability() >= (8, 9):
+                # Requires torch.compile (applied after loading) to fuse the FP8 matmul kernels
+                from transformers import FineGrainedFP8Config
+                logger.info(f"Loading {self.model_id} with FP8 weights and activations...")
+                return {"quantization_config": FineGrainedFP8Config(), "torch_dtype": torch.bfloat16}
+            logger.warning("FP8 requires compute capability 8.9+, falling back to BF16")
+
+        # BF16 keeps FP32 range for the logits while still hitting the fused SDPA kernels
+        dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        logger.info(f"Loading {self.model_id} in {dtype} with SDPA attention...")
+        return {"torch_dtype": dtype}
+
+    def _compile_model(self):
+        """Wraps the forward pass with torch.compile and captures CUDA graphs for every shape bucket."""
+        if not torch.cuda.is_available():
+            return
+
+        try:
+            self.model = torch.compile(self.model, mode="reduce-overhead", fullgraph=False)
+            self._compiled = True
+
+            logger.info(f"Warming up compiled reranker for shapes {SHAPE_BUCKETS}...")
+            pad_id = self.tokenizer.pad_token_id or 0
+            for length in SHAPE_BUCKETS:
+                self._score_bucket([[pad_id] * length])
+        except Exception as e:
+            logger.warning(f"torch.compile unavailable for reranker, using eager forward: {e}")
+            self.model = getattr(self.model, "_orig_mod", self.model)
+            self._compiled = False
+
+    def rerank(self, query: str, documents: List[str], top_n: int = 5, batch_size: int = DEFAULT_BATCH_SIZE) -> List[Dict[str, Any]]:
         """
-        Reranks a list of documents based on a query using small batches to avoid OOM.
-        Returns a list of dictionaries with index and score, sorted by score descending.
+        Reranks a list of documents based on a query using length-bucketed batches to avoid OOM.
+        The query is tokenized once and each (query, document) pair is padded only to the longest
+        pair in its bucket. Returns a list of dictionaries with index and score, sorted by score descending.
         """
         if not documents:
             return []
@@ -58,68 +198,239 @@ class JinaReranker:
         self._load_model()
 
         try:
-            clean_docs = [str(doc) if doc is not None else "" for doc in documents]
-            all_scores = []
+            # Keep the head (file, name, summary and signature come first), skip tokenizing the rest
+            clean_docs = [str(doc)[:MAX_DOC_CHARS] if doc is not None else "" for doc in documents]
+            pairs = self._encode_pairs(query, clean_docs)
             
-            # Process in batches
-            for i in range(0, len(clean_docs), batch_size):
-                batch_docs = clean_docs[i:i + batch_size]
-                pairs = [[query, doc] for doc in batch_docs]
-                
-                batch_scores = None
-                with torch.inference_mode():
-                    # Try the model's built-in compute_score first
-                    if hasattr(self.model, 'compute_score'):
-                        try:
-                            res = self.model.compute_score(pairs, max_length=1024)
-                            if isinstance(res, (list, torch.Tensor)):
-                                batch_scores = res
-                            elif isinstance(res, tuple) and len(res) > 0:
-                                batch_scores = res[0]
-                            else:
-                                batch_scores = res
-                        except Exception as ce:
-                            logger.warning(f"Batch compute_score failed: {ce}")
-
-                    # Fallback to manual scoring for this batch
-                    if batch_scores is None:
-                        inputs = self.tokenizer(
-                            pairs, 
-                            padding=True, 
-                            truncation=True, 
-                            return_tensors="pt", 
-                            max_length=1024
-                        ).to(self.model.device)
-                        
-                        inputs.pop("token_type_ids", None)
-                        
-                        outputs = self.model(**inputs, return_dict=True)
-                        if hasattr(outputs, 'logits'):
-                            logits = outputs.logits.view(-1, ).float()
-                        else:
-                            logits = outputs[0].view(-1, ).float()
-                            
-                        batch_scores = torch.sigmoid(logits).cpu().numpy().tolist()
-                
-                if isinstance(batch_scores, torch.Tensor):
-                    batch_scores = batch_scores.cpu().numpy().tolist()
-                elif not isinstance(batch_scores, list):
-                    batch_scores = [float(batch_scores)]
-                
-                all_scores.extend(batch_scores)
-                
-            results = [
-                {"index": i, "score": float(score)}
-                for i, score in enumerate(all_scores)
-            ]
+            # Sort by length so each bucket holds pairs of similar size
+            order = sorted(range(len(pairs)), key=lambda i: len(pairs[i]))
             
-            results.sort(key=lambda x: x["score"], reverse=True)
+            # Buckets are contiguous runs of `order`, so their scores concatenate in sorted order
+            bucket_pairs = [[pairs[i] for i in bucket] for bucket in self._length_buckets(order, pairs, batch_size)]
+            if torch.cuda.is_available():
+                sorted_scores = torch.cat([s.float() for s in self._score_buckets_pipelined(bucket_pairs)])
+            else:
+                sorted_scores = torch.cat([self._score_with_oom_retry(bp).float() for bp in bucket_pairs])
+            all_scores = torch.empty_like(sorted_scores)
+            all_scores[torch.tensor(order, device=sorted_scores.device)] = sorted_scores
             
-            return results[:top_n]
+            # Partial sort on device, only the top-n leave the GPU
+            vals, idx = torch.topk(all_scores, min(top_n, all_scores.numel()))
+            
+            return [
+                {"index": int(i), "score": float(v)}
+                for v, i in zip(vals.tolist(), idx.tolist())
+            ]
         except Exception as e:
             logger.error(f"Error during reranking: {e}", exc_info=True)
             return [{"index": i, "score": 0.0001 / (i + 1)} for i in range(min(len(documents), top_n))]
 
+    def _encode_pairs(self, query: str, documents: List[str]) -> List[List[int]]:
+        """
+        Tokenizes the query once and every uncached document in a single fast-tokenizer call,
+        then builds the special-token framed input ids for every pair.
+        """
+        q_ids = self._tokenize_cached([query])[0][:MAX_LENGTH // 2]
+        
+        doc_budget = max(MAX_LENGTH - len(q_ids) - self.tokenizer.num_special_tokens_to_add(pair=True), 1)
+        d_ids_list = self._tokenize_cached(documents)
+
+        framing = self._pair_framing(q_ids)
+        if framing is None:
+            return [self.tokenizer.build_inputs_with_special_tokens(q_ids, d_ids[:doc_budget]) for d_ids in d_ids_list]
+        prefix, suffix = framing
+        return [prefix + d_ids[:doc_budget] + suffix for d_ids in d_ids_list]
+
+    def _pair_framing(self, q_ids: List[int]):
+        """
+        Returns the (prefix, suffix) ids surrounding the document in a framed pair, so the query and
+        special tokens are assembled once per call instead of once per document.
+        Returns None if the tokenizer does not frame pairs by plain concatenation.
+        """
+        # -1 is never a real token id, so it marks where the document goes
+        framed = self.tokenizer.build_inputs_with_special_tokens(q_ids, [-1])
+        if framed.count(-1) != 1:
+            return None
+        split = framed.index(-1)
+        return framed[:split], framed[split + 1:]
+
+    def _tokenize_cached(self, texts: List[str]) -> List[List[int]]:
+        """
+        Returns token ids (no special tokens, capped at MAX_LENGTH) for each text.
+        Texts seen in previous calls are served from an LRU cache; the rest are tokenized in one batch.
+        """
+        results: List[Any] = [None] * len(texts)
+        missing = []
+        with self._token_cache_lock:
+            for i, text in enumerate(texts):
+                ids = self._token_cache.get(text)
+                if ids is None:
+                    missing.append(i)
+                else:
+                    self._token_cache.move_to_end(text)
+                    results[i] = ids
+
+        if missing:
+            encoded = self.tokenizer(
+                [texts[i] for i in missing],
+                add_special_tokens=False,
+                truncation=True,
+                max_length=MAX_LENGTH
+            ).input_ids
+            with self._token_cache_lock:
+                for i, ids in zip(missing, encoded):
+                    results[i] = ids
+                    self._token_cache[texts[i]] = ids
+                while len(self._token_cache) > TOKEN_CACHE_SIZE:
+                    self._token_cache.popitem(last=False)
+
+        return results
+
+    def _length_buckets(self, order: List[int], pairs: List[List[int]], batch_size: int) -> List[List[int]]:
+        """
+        Splits length-sorted pair indices into buckets bounded by BIN_TOKENS padded tokens.
+        A bucket also closes when lengths spread past MAX_LENGTH_SPREAD, so short pairs are not padded
+        up to a much longer one; uniform lengths still end up in a single bucket.
+        """
+        buckets = []
+        current = []
+        shortest = 0
+        for idx in order:
+            # Sorted ascending, so the incoming pair is the longest of the bucket
+            padded_length = self._padded_length(len(pairs[idx]))
+            padded_tokens = padded_length * (len(current) + 1)
+            too_spread = padded_length > shortest * MAX_LENGTH_SPREAD
+            if current and (padded_tokens > BIN_TOKENS or len(current) >= batch_size or too_spread):
+                buckets.append(current)
+                current = []
+            if not current:
+                shortest = padded_length
+            current.append(idx)
+        if current:
+            buckets.append(current)
+        return buckets
+
+    def _score_buckets_pipelined(self, bucket_pairs: List[List[List[int]]]) -> List[torch.Tensor]:
+        """
+        Double-buffers the buckets on CUDA: bucket N+1 is padded on a worker thread and uploaded on a
+        side stream while bucket N runs its forward pass on the compute stream.
+        """
+        compute_stream = torch.cuda.current_stream()
+        upload_stream = torch.cuda.Stream()
+        device = self.model.device
+
+        scores = []
+        next_inputs = self._prep_executor.submit(self._prepare_bucket, bucket_pairs[0])
+        for k, pairs in enumerate(bucket_pairs):
+            input_ids, attention_mask = next_inputs.result()
+            if k + 1 < len(bucket_pairs):
+                next_inputs = self._prep_executor.submit(self._prepare_bucket, bucket_pairs[k + 1])
+
+            with torch.cuda.stream(upload_stream):
+                input_ids = input_ids.to(device, non_blocking=True)
+                attention_mask = attention_mask.to(device, non_blocking=True)
+            compute_stream.wait_stream(upload_stream)
+            # The buffers were allocated on the upload stream but are consumed on the compute stream
+            input_ids.record_stream(compute_stream)
+            attention_mask.record_stream(compute_stream)
+
+            try:
+                scores.append(self._forward(input_ids, attention_mask, len(pairs)))
+            except torch.cuda.OutOfMemoryError:
+                del input_ids, attention_mask
+                torch.cuda.empty_cache()
+                scores.append(self._score_with_oom_retry(pairs))
+        return scores
+
+    def _score_with_oom_retry(self, bucket_pairs: List[List[int]]) -> torch.Tensor:
+        """Scores a bucket, releasing the allocator cache and halving the bucket only when CUDA runs out of memory."""
+        try:
+            return self._score_bucket(bucket_pairs)
+        except torch.cuda.OutOfMemoryError:
+            if len(bucket_pairs) == 1:
+                raise
+            logger.warning(f"Reranker OOM on a bucket of {len(bucket_pairs)} pairs, retrying in halves")
+            torch.cuda.empty_cache()
+            mid = len(bucket_pairs) // 2
+            return torch.cat([
+                self._score_with_oom_retry(bucket_pairs[:mid]),
+                self._score_with_oom_retry(bucket_pairs[mid:])
+            ])
+
+    def _padded_length(self, length: int) -> int:
+        """Returns the sequence length a pair is padded to (the next shape bucket when compiled)."""
+        if not self._compiled:
+            return min(-(-length // PAD_MULTIPLE) * PAD_MULTIPLE, MAX_LENGTH)
+        return next((b for b in SHAPE_BUCKETS if b >= length), MAX_LENGTH)
+
+    def _score_bucket(self, bucket_pairs: List[List[int]]) -> torch.Tensor:
+        """Pads a bucket to its own longest pair and runs a single forward pass. Scores stay on device."""
+        input_ids, attention_mask = self._prepare_bucket(bucket_pairs)
+        return self._forward(input_ids, attention_mask, len(bucket_pairs))
+
+    def _prepare_bucket(self, bucket_pairs: List[List[int]]):
+        """Builds the padded (input_ids, attention_mask) host tensors of a bucket."""
+        n_pairs = len(bucket_pairs)
+        max_len = self._padded_length(max(len(ids) for ids in bucket_pairs))
+        n_rows = n_pairs
+        if self._compiled:
+            # Pad the batch dimension too so every call replays an already captured graph
+            n_rows = max(n_pairs, min(DEFAULT_BATCH_SIZE, BIN_TOKENS // max_len))
+        pad_id = self.tokenizer.pad_token_id or 0
+        
+        # Filler rows hold a single token so their softmax stays well defined
+        rows = bucket_pairs + [[pad_id]] * (n_rows - n_pairs)
+        encoded = self.tokenizer.pad(
+            {"input_ids": rows},
+            padding="max_length",
+            max_length=max_len,
+            return_attention_mask=True,
+            return_tensors="pt"
+        )
+        input_ids = encoded["input_ids"]
+        attention_mask = encoded["attention_mask"]
+
+        if torch.cuda.is_available():
+            # Pinned host buffers allow the upload to overlap with queued kernels
+            input_ids = input_ids.pin_memory()
+            attention_mask = attention_mask.pin_memory()
+        return input_ids, attention_mask
+
+    def _forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor, n_pairs: int) -> torch.Tensor:
+        """Runs the model on a prepared bucket and returns the sigmoid scores of its real rows."""
+        if self._onnx:
+            # The ONNX session takes the whole padded batch as NumPy arrays in a single run
+            outputs = self.model(input_ids=input_ids.numpy(), attention_mask=attention_mask.numpy())
+            logits = torch.as_tensor(outputs.logits).view(-1, ).float()
+            return torch.sigmoid(logits[:n_pairs])
+
+        with torch.inference_mode(), _matmul_precision(FORWARD_MATMUL_PRECISION):
+            outputs = self.model(
+                input_ids=input_ids.to(self.model.device, non_blocking=True),
+                attention_mask=attention_mask.to(self.model.device, non_blocking=True),
+                return_dict=True
+            )
+            if hasattr(outputs, 'logits'):
+                logits = outputs.logits.view(-1, ).float()
+            else:
+                logits = outputs[0].view(-1, ).float()
+                
+            return torch.sigmoid(logits[:n_pairs])
+
+@contextlib.contextmanager
+def _matmul_precision(precision: str):
+    """Temporarily sets the FP32 matmul precision, restoring the previous one on exit."""
+    previous = torch.get_float32_matmul_precision()
+    if previous == precision:
+        yield
+        return
+    torch.set_float32_matmul_precision(precision)
+    try:
+        yield
+    finally:
+        torch.set_float32_matmul_precision(previous)
+
+@functools.lru_cache(maxsize=1)
 def get_reranker():
     return JinaReranker()
 
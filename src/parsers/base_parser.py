@@ -1,20 +1,70 @@
 from abc import ABC, abstractmethod
+import hashlib
 import logging
+import threading
+from dataclasses import dataclass
 from typing import List, Optional, Dict, Any
+from tree_sitter import Parser, QueryCursor
 from src.IR.models import CodeSnippet
 
 logger = logging.getLogger(__name__)
 
+# Caps in-progress query matches so pathological files cannot make captures quadratic
+QUERY_MATCH_LIMIT = 256
+
+try:
+    from blake3 import blake3 as _blake3
+except ImportError:
+    _blake3 = None
+
+def hash_bytes(data: bytes) -> str:
+    """Fast non-cryptographic fingerprint for cache keys and snippet IDs (blake3, SHA-256 if unavailable)"""
+    if _blake3 is not None:
+        return _blake3(data).hexdigest()
+    return hashlib.sha256(data).hexdigest()
+
+def hash_fields(*fields: Any) -> str:
+    """hash_bytes over ':'-separated fields, fed to the hasher one by one instead of formatting a key string"""
+    hasher = _blake3() if _blake3 is not None else hashlib.sha256()
+    for i, value in enumerate(fields):
+        if i:
+            hasher.update(b":")
+        hasher.update(value if isinstance(value, bytes) else str(value).encode("utf-8"))
+    return hasher.hexdigest()
+
+@dataclass(slots=True)
+class FileCacheEntry:
+    """Everything cached for a single file, co-located so one lookup serves all fields."""
+    tree: Any = None
+    code: str = ""
+    snippets: Optional[List[CodeSnippet]] = None
+    content_hash: str = ""
+
 class BaseParser(ABC):
     def __init__(self, chunk_size: int = 8000, llm: Optional[Any] = None):
-        self._tree_cache: Dict[str, Any] = {}
-        self._code_cache: Dict[str, str] = {}
-        self._snippet_cache: Dict[str, List[CodeSnippet]] = {}
-        self._content_hash_cache: Dict[str, str] = {}
-        self._metadata_cache: Dict[str, Dict[str, Any]] = {}
+        self._file_cache: Dict[Optional[str], FileCacheEntry] = {}
+        self._local = threading.local()
         self.chunk_size = chunk_size
         self.llm = llm
 
+    @property
+    def parser(self) -> Parser:
+        """tree-sitter parsers are not thread-safe, so each thread lazily gets its own"""
+        parser = getattr(self._local, "parser", None)
+        if parser is None:
+            parser = Parser(self.language)
+            self._local.parser = parser
+        return parser
+
+    @property
+    def query_cursor(self) -> QueryCursor:
+        """Per-thread cursor over the compiled `self._query`, reused across files"""
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            cursor = QueryCursor(self._query, match_limit=QUERY_MATCH_LIMIT)
+            self._local.cursor = cursor
+        return cursor
+
     @property
     @abstractmethod
     def language_id(self) -> str:
@@ -22,31 +72,36 @@ class BaseParser(ABC):
         pass
 
     @abstractmethod
-    def parse_file(self, code: str, file_path: Optional[str] = None) -> List[CodeSnippet]:
-        """Should return a list of Normalized IR objects (CodeSnippet)"""
+    def parse_file(self, code: str, file_path: Optional[str] = None, content_hash: Optional[str] = None) -> List[CodeSnippet]:
+        """Should return a list of Normalized IR objects (CodeSnippet). content_hash avoids rehashing a known file"""
         pass
 
-    def get_cached_snippets(self, file_path: str, code: str) -> Optional[List[CodeSnippet]]:
+    def get_cached_snippets(self, file_path: str, code: str, code_bytes: Optional[bytes] = None, content_hash: Optional[str] = None) -> Optional[List[CodeSnippet]]:
         """Returns cached snippets if the content hasn't changed"""
-        import hashlib
-        content_hash = hashlib.sha256(code.encode("utf-8")).hexdigest()
+        if content_hash is None:
+            content_hash = hash_bytes(code_bytes if code_bytes is not None else code.encode("utf-8"))
         
-        if file_path in self._content_hash_cache:
-            if self._content_hash_cache[file_path] == content_hash:
-                return self._snippet_cache.get(file_path)
+        entry = self._file_cache.setdefault(file_path, FileCacheEntry())
+        if entry.content_hash == content_hash:
+            return entry.snippets
         
-        self._content_hash_cache[file_path] = content_hash
+        entry.content_hash = content_hash
         return None
 
     def cache_snippets(self, file_path: str, snippets: List[CodeSnippet]):
         """Caches snippets for a file"""
-        self._snippet_cache[file_path] = snippets
+        self._file_cache.setdefault(file_path, FileCacheEntry()).snippets = snippets
+
+    def get_file_cache(self, file_path: Optional[str]) -> FileCacheEntry:
+        """Returns the cache entry for a file, creating an empty one if needed"""
+        return self._file_cache.setdefault(file_path, FileCacheEntry())
 
     def apply_edit(self, file_path: str, start_byte: int, old_end_byte: int, new_end_byte: int,
                    start_point: tuple, old_end_point: tuple, new_end_point: tuple):
         """Applies an edit to the cached tree for incremental parsing"""
-        if file_path in self._tree_cache:
-            self._tree_cache[file_path].edit(
+        entry = self._file_cache.get(file_path)
+        if entry and entry.tree:
+            entry.tree.edit(
                 start_byte=start_byte,
                 old_end_byte=old_end_byte,
                 new_end_byte=new_end_byte,
@@ -1,63 +1,100 @@
 import tree_sitter_c as tsc
 import logging
-from tree_sitter import Language, Parser, Query, QueryCursor
+from tree_sitter import Language, Query
 from typing import List, Optional, Any
-from src.parsers.base_parser import BaseParser
+from src.parsers.base_parser import BaseParser, hash_fields
 from src.IR.models import CodeSnippet, SnippetType
-import hashlib
 
 from src.parsers.chunker import CodeChunker
 
 logger = logging.getLogger(__name__)
 
+C_LANGUAGE = Language(tsc.language())
+
+# Sibling node types that may separate a definition from its leading comment block
+SKIP_TYPES = frozenset(("\n", " "))
+# Leading comment blocks longer than this many sibling nodes are not treated as documentation
+MAX_COMMENT_SIBLINGS = 50
+# Node types holding the members of a struct / enum
+BODY_TYPES = frozenset(("field_declaration_list", "enumerator_list"))
+
 class CParser(BaseParser):
+    QUERY = """
+    (function_definition) @function.def
+
+    (function_definition
+      declarator: [
+        (function_declarator declarator: (identifier) @function.name)
+        (pointer_declarator declarator: (function_declarator declarator: (identifier) @function.name))
+        (pointer_declarator declarator: (pointer_declarator declarator: (function_declarator declarator: (identifier) @function.name)))
+      ])
+
+    (struct_specifier
+      body: (field_declaration_list)) @struct.def
+    
+    (type_definition
+      type: (struct_specifier)) @struct.def
+
+    (enum_specifier
+      body: (enumerator_list)) @enum.def
+    
+    (type_definition
+      type: (enum_specifier)) @enum.def
+    """
+    # The query text is constant, so it is compiled once and shared by every instance
+    COMPILED_QUERY = Query(C_LANGUAGE, QUERY)
+
     def __init__(self, chunk_size: int = 500, llm: Optional[Any] = None):
         super().__init__(chunk_size=chunk_size, llm=llm)
-        self.language = Language(tsc.language())
-        self.parser = Parser(self.language)
+        self.language = C_LANGUAGE
+        self._query = self.COMPILED_QUERY
         self.chunker = CodeChunker(language="c", chunk_max_characters=chunk_size)
+        # Each capture tag resolves its type, name and signature with a single call
+        self._describers = {
+            "function.def": self._describe_function,
+            "struct.def": self._describe_struct,
+            "enum.def": self._describe_enum,
+        }
 
     @property
     def language_id(self) -> str:
         return "c"
 
     def get_query(self) -> str:
-        return """
-        (function_definition) @function.def
-
-        (struct_specifier
-          body: (field_declaration_list)) @struct.def
-        
-        (type_definition
-          type: (struct_specifier)) @struct.def
+        return self.QUERY
 
-        (enum_specifier
-          body: (enumerator_list)) @enum.def
-        
-        (type_definition
-          type: (enum_specifier)) @enum.def
-        """
-
-    def parse_file(self, code: str, file_path: Optional[str] = None) -> List[CodeSnippet]:
+    def parse_file(self, code: str, file_path: Optional[str] = None, content_hash: Optional[str] = None) -> List[CodeSnippet]:
+        # A known content hash lets an unchanged file return before the source is even encoded
+        code_bytes = None if content_hash is not None else code.encode("utf-8")
         if file_path:
-            cached = self.get_cached_snippets(file_path, code)
+            cached = self.get_cached_snippets(file_path, code, code_bytes, content_hash=content_hash)
             if cached is not None:
                 return cached
+        if code_bytes is None:
+            code_bytes = code.encode("utf-8")
 
-        old_tree = self._tree_cache.get(file_path) if file_path else None
+        entry = self.get_file_cache(file_path) if file_path else None
+        old_tree = entry.tree if entry else None
         
         if old_tree:
-            tree = self.parser.parse(bytes(code, "utf8"), old_tree)
+            tree = self.parser.parse(code_bytes, old_tree)
         else:
-            tree = self.parser.parse(bytes(code, "utf8"))
+            tree = self.parser.parse(code_bytes)
         
-        if file_path:
-            self._tree_cache[file_path] = tree
-            self._code_cache[file_path] = code
+        if entry:
+            entry.tree = tree
+            entry.code = code
 
-        query = Query(self.language, self.get_query())
-        cursor = QueryCursor(query)
-        captures_dict = cursor.captures(tree.root_node)
+        captures_dict = self.query_cursor.captures(tree.root_node)
+        
+        # Map each function definition to its captured name identifier
+        name_nodes = {}
+        for name_node in captures_dict.pop("function.name", []):
+            def_node = name_node.parent
+            while def_node and def_node.type != "function_definition":
+                def_node = def_node.parent
+            if def_node:
+                name_nodes[def_node.id] = name_node
         
         all_captures = []
         for tag, nodes in captures_dict.items():
@@ -69,164 +106,87 @@ class CParser(BaseParser):
         all_captures.sort(key=lambda x: (x[0].start_byte, -x[0].end_byte))
 
         snippets = []
-        processed_ranges = []
+        # Syntax nodes are either disjoint or nested, so with this ordering a node can only be
+        # nested in the most recently accepted one: tracking its end byte is enough
+        current_end = -1
 
         for node, tag in all_captures:
-            is_nested = False
-            for start, end in processed_ranges:
-                if node.start_byte >= start and node.end_byte <= end:
-                    is_nested = True
-                    break
-            
-            if is_nested:
+            if node.end_byte <= current_end:
                 continue
 
-            extracted = self._extract_snippets(node, tag, code, file_path)
+            extracted = self._extract_snippets(node, tag, code_bytes, file_path, name_nodes.get(node.id))
             snippets.extend(extracted)
-            processed_ranges.append((node.start_byte, node.end_byte))
+            current_end = node.end_byte
         
         if file_path:
             self.cache_snippets(file_path, snippets)
             
         return snippets
 
-    def _extract_snippets(self, node, tag, code, file_path) -> List[CodeSnippet]:
-        full_content = code[node.start_byte:node.end_byte]
+    def _extract_snippets(self, node, tag, code_bytes, file_path, name_node=None) -> List[CodeSnippet]:
+        full_content = code_bytes[node.start_byte:node.end_byte].decode("utf-8")
         
         # Determine the body node for skeletonization/chunking
         body_node = node.child_by_field_name("body")
         if not body_node:
             for child in node.children:
-                if child.type in ["field_declaration_list", "enumerator_list"]:
+                if child.type in BODY_TYPES:
                     body_node = child
                     break
 
         if len(full_content) <= self.chunk_size:
-            snippet = self._create_snippet(node, tag, code, file_path, full_content)
+            snippet = self._create_snippet(node, tag, code_bytes, file_path, full_content, name_node=name_node)
             return [snippet]
         
         # If chunking, the parent becomes a skeleton
-        skeleton_content = code[node.start_byte:body_node.start_byte] if body_node else full_content
-        parent_snippet = self._create_snippet(node, tag, code, file_path, full_content, override_content=skeleton_content)
+        skeleton_content = code_bytes[node.start_byte:body_node.start_byte].decode("utf-8") if body_node else full_content
+        parent_snippet = self._create_snippet(node, tag, code_bytes, file_path, full_content, override_content=skeleton_content, name_node=name_node)
         parent_snippet.is_skeleton = True
         
-        nodes = self.chunker.chunk_to_nodes(full_content)
+        chunks = self.chunker.chunk_node(node, body_node, code_bytes)
         
         snippets = [parent_snippet]
-        for i, text_node in enumerate(nodes):
-            display_name = None
-            if "inclusive_scopes" in text_node.metadata and text_node.metadata["inclusive_scopes"]:
-                scopes = text_node.metadata["inclusive_scopes"]
-                display_name = scopes[-1]["name"]
-
-            chunk_content = text_node.get_content()
-            snippet = self._create_snippet(node, tag, code, file_path, chunk_content, chunk_index=i)
+        for i, chunk in enumerate(chunks):
+            snippet = self._create_snippet(node, tag, code_bytes, file_path, chunk.text, chunk_index=i, name_node=name_node)
             snippet.parent_id = parent_snippet.id
             
-            if display_name:
-                snippet.name = f"{display_name}_chunk_{i}"
+            if chunk.scope_name:
+                snippet.name = f"{chunk.scope_name}_chunk_{i}"
 
-            snippet.metadata["llama_index_node_id"] = text_node.node_id
-            if text_node.parent_node:
-                snippet.metadata["llama_index_parent_id"] = text_node.parent_node.node_id
+            snippet.metadata["chunk_start_byte"] = chunk.start_byte
+            snippet.metadata["chunk_end_byte"] = chunk.end_byte
                 
             snippets.append(snippet)
         
         return snippets
 
-    def _create_snippet(self, node, tag, code, file_path, content_for_id, chunk_index: Optional[int] = None, override_content: Optional[str] = None) -> CodeSnippet:
-        id_base = f"{file_path}:{node.start_byte}:{chunk_index}:{content_for_id}"
-        snippet_id = hashlib.sha256(id_base.encode("utf-8")).hexdigest()
+    def _create_snippet(self, node, tag, code_bytes, file_path, content_for_id, chunk_index: Optional[int] = None, override_content: Optional[str] = None, name_node=None) -> CodeSnippet:
+        snippet_id = hash_fields(file_path, node.start_byte, node.end_byte, chunk_index)
         actual_content = override_content if override_content is not None else content_for_id
 
-        cached_meta = self._metadata_cache.get(snippet_id)
-        if cached_meta:
-            return CodeSnippet(
-                id=snippet_id,
-                name=cached_meta["name"],
-                type=cached_meta["type"],
-                content=actual_content,
-                parent_id=None,
-                docstring=cached_meta["docstring"],
-                signature=cached_meta["signature"],
-                file_path=file_path,
-                start_line=node.start_point[0],
-                end_line=node.end_point[0],
-                start_byte=node.start_byte,
-                end_byte=node.end_byte,
-                is_skeleton=override_content is not None,
-                metadata={"chunk_index": chunk_index, "ts_node_id": node.id} if chunk_index is not None else {"ts_node_id": node.id}
-            )
-
-        if tag == "function.def":
-            snippet_type = SnippetType.FUNCTION
-        elif "enum" in tag:
-            snippet_type = SnippetType.ENUM
-        else:
-            snippet_type = SnippetType.STRUCT 
-
-        name = "anonymous"
-        
-        if snippet_type == SnippetType.FUNCTION:
-            decl = node.child_by_field_name("declarator")
-            if decl:
-                def find_identifier(n):
-                    if n.type == "identifier":
-                        return n
-                    for child in n.children:
-                        res = find_identifier(child)
-                        if res:
-                            return res
-                    return None
-                
-                name_node = find_identifier(decl)
-                if name_node:
-                    name = code[name_node.start_byte:name_node.end_byte]
-        else:
-            # Struct / Enum
-            if node.type == "type_definition":
-                name_node = node.child_by_field_name("declarator")
-                if name_node:
-                    name = code[name_node.start_byte:name_node.end_byte]
-            else:
-                name_node = node.child_by_field_name("name")
-                if name_node:
-                    name = code[name_node.start_byte:name_node.end_byte]
+        snippet_type, name, signature = self._describers[tag](node, code_bytes, name_node)
 
         if chunk_index is not None:
             name = f"{name}_chunk_{chunk_index}"
 
-        # Signature
-        if snippet_type == SnippetType.FUNCTION:
-            decl_node = node.child_by_field_name("declarator")
-            if decl_node:
-                signature = code[decl_node.start_byte:decl_node.end_byte]
-            else:
-                signature = name
-        else:
+        if signature is None:
             signature = name
 
         # Docstring / Comments
         comments = []
         prev = node.prev_sibling
-        while prev:
-            if prev.type == "comment":
-                comments.append(code[prev.start_byte:prev.end_byte].strip("/ ").strip("*").strip())
-                prev = prev.prev_sibling
-            elif prev.type in ["\n", " "]: 
-                prev = prev.prev_sibling
-            else:
+        for _ in range(MAX_COMMENT_SIBLINGS):
+            if prev is None:
+                break
+            prev_type = prev.type
+            if prev_type == "comment":
+                comments.append(code_bytes[prev.start_byte:prev.end_byte].decode("utf-8").strip("/ ").strip("*").strip())
+            elif prev_type not in SKIP_TYPES:
                 break
+            prev = prev.prev_sibling
         
         docstring = "\n".join(reversed(comments)) if comments else None
 
-        self._metadata_cache[snippet_id] = {
-            "name": name,
-            "type": snippet_type,
-            "docstring": docstring,
-            "signature": signature
-        }
-
         metadata = {"ts_node_id": node.id}
         if chunk_index is not None:
             metadata["chunk_index"] = chunk_index
@@ -247,3 +207,24 @@ class CParser(BaseParser):
             is_skeleton=override_content is not None,
             metadata=metadata
         )
+
+    def _describe_function(self, node, code_bytes, name_node):
+        # Resolved from the @function.name query capture in parse_file
+        name = code_bytes[name_node.start_byte:name_node.end_byte].decode("utf-8") if name_node else "anonymous"
+        decl_node = node.child_by_field_name("declarator")
+        signature = code_bytes[decl_node.start_byte:decl_node.end_byte].decode("utf-8") if decl_node else None
+        return SnippetType.FUNCTION, name, signature
+
+    def _describe_struct(self, node, code_bytes, name_node):
+        return SnippetType.STRUCT, self._type_name(node, code_bytes), None
+
+    def _describe_enum(self, node, code_bytes, name_node):
+        return SnippetType.ENUM, self._type_name(node, code_bytes), None
+
+    def _type_name(self, node, code_bytes) -> str:
+        """Returns the typedef alias or the tag name of a struct / enum."""
+        field = "declarator" if node.type == "type_definition" else "name"
+        name_node = node.child_by_field_name(field)
+        if name_node:
+            return code_bytes[name_node.start_byte:name_node.end_byte].decode("utf-8")
+        return "anonymous"
@@ -1,20 +1,96 @@
 import logging
-from typing import List
-from llama_index.core.schema import TextNode
-from llama_index.packs.code_hierarchy import CodeHierarchyNodeParser
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from src.parsers.base_parser import hash_bytes
 
 logger = logging.getLogger(__name__)
 
+# Number of chunked definitions remembered by content, so vendored or copied code is split only once
+CHUNK_CACHE_SIZE = 1024
+
+DEFINITION_TYPES = frozenset({"function_definition", "class_definition", "decorated_definition"})
+
+
+@dataclass(slots=True)
+class CodeChunk:
+    text: str
+    start_byte: int
+    end_byte: int
+    scope_name: Optional[str] = None
+
+
 class CodeChunker:
+    """Splits the body of an already parsed definition into chunks of consecutive statements."""
+
     def __init__(self, language: str, chunk_min_characters: int = 200, chunk_max_characters: int = 1000):
-        target_language = "cpp" if language == "c" else language
-        
-        self.parser = CodeHierarchyNodeParser(
-            language=target_language,
-            chunk_min_characters=chunk_min_characters,
-        )
+        self.language = language
+        self.chunk_min_characters = chunk_min_characters
+        self.chunk_max_characters = chunk_max_characters
+        # Content hash -> chunk layout as (start, end, scope name) offsets relative to the node
+        self._cache: "OrderedDict[str, List[Tuple[int, int, Optional[str]]]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def chunk_node(self, node, body_node, code_bytes: bytes) -> List[CodeChunk]:
+        """Groups the body statements of `node` into chunks of at most `chunk_max_characters`.
+
+        Statements are merged until the chunk reaches `chunk_min_characters`, and a single
+        statement larger than the maximum is kept whole rather than split mid-syntax.
+        Identical definitions reuse the layout computed for the first one.
+        """
+        base = node.start_byte
+        key = hash_bytes(code_bytes[base:node.end_byte])
+        with self._cache_lock:
+            layout = self._cache.get(key)
+            if layout is not None:
+                self._cache.move_to_end(key)
+
+        if layout is None:
+            layout = [(c.start_byte - base, c.end_byte - base, c.scope_name) for c in self._split(node, body_node, code_bytes)]
+            with self._cache_lock:
+                self._cache[key] = layout
+                while len(self._cache) > CHUNK_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+
+        return [self._make_chunk(base + start, base + end, code_bytes, scope_name) for start, end, scope_name in layout]
+
+    def _split(self, node, body_node, code_bytes: bytes) -> List[CodeChunk]:
+        children = body_node.named_children if body_node is not None else []
+        if not children:
+            return [self._make_chunk(node.start_byte, node.end_byte, code_bytes)]
+
+        chunks = []
+        start = end = None
+        scope_name = None
+        for child in children:
+            if start is not None:
+                too_large = child.end_byte - start > self.chunk_max_characters
+                if too_large and end - start >= self.chunk_min_characters:
+                    chunks.append(self._make_chunk(start, end, code_bytes, scope_name))
+                    start = None
+
+            if start is None:
+                start = child.start_byte
+                scope_name = self._scope_name(child, code_bytes)
+            end = child.end_byte
+
+        chunks.append(self._make_chunk(start, end, code_bytes, scope_name))
+        return chunks
 
-    def chunk_to_nodes(self, code: str) -> List[TextNode]:
-        """Splits code into a hierarchy of nodes."""
-        return self.parser.get_nodes_from_documents([TextNode(text=code)])
+    def _make_chunk(self, start: int, end: int, code_bytes: bytes, scope_name: Optional[str] = None) -> CodeChunk:
+        return CodeChunk(code_bytes[start:end].decode("utf-8"), start, end, scope_name)
 
+    def _scope_name(self, node, code_bytes: bytes) -> Optional[str]:
+        """Returns the name of a nested definition starting the chunk, if any."""
+        if node.type not in DEFINITION_TYPES:
+            return None
+        if node.type == "decorated_definition":
+            node = node.child_by_field_name("definition")
+            if node is None:
+                return None
+        name_node = node.child_by_field_name("name")
+        if name_node is None:
+            return None
+        return code_bytes[name_node.start_byte:name_node.end_byte].decode("utf-8")
@@ -1,6 +1,9 @@
 import os
+import hashlib
 import logging
-from typing import Dict, Optional, List, Any
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Dict, Optional, List, Any, Tuple
 from src.parsers.base_parser import BaseParser
 from src.parsers.python_parser import PythonParser
 from src.parsers.c_parser import CParser
@@ -8,6 +11,29 @@ from src.IR.models import CodeSnippet
 
 logger = logging.getLogger(__name__)
 
+# Files above this size are almost always generated or vendored artifacts
+MAX_FILE_SIZE = 2 * 1024 * 1024
+# A NUL byte in the first block is a reliable marker of a binary file
+BINARY_SNIFF_SIZE = 4096
+# Files sent to a worker process per round trip when parsing with processes
+PROCESS_CHUNK_SIZE = 16
+
+# Each worker process owns its own parsers, tree-sitter objects cannot be shared across processes
+_worker_factory: Optional["ParserFactory"] = None
+
+def _init_worker(chunk_size: int):
+    global _worker_factory
+    _worker_factory = ParserFactory(chunk_size=chunk_size)
+
+def _parse_in_worker(task: Tuple[str, str, str]) -> List[CodeSnippet]:
+    file_path, content, content_hash = task
+    try:
+        parser = _worker_factory.get_parser_for_file(file_path)
+        return parser.parse_file(content, file_path, content_hash=content_hash)
+    except Exception as e:
+        logger.error(f"Error parsing {file_path}: {e}")
+        return []
+
 class ParserFactory:
     def __init__(self, chunk_size: int = 500, llm: Optional[Any] = None):
         self.chunk_size = chunk_size
@@ -35,52 +61,133 @@ class ParserFactory:
         recursive: bool = False,
         ignore_dirs: Optional[List[str]] = None,
         ignore_exts: Optional[List[str]] = None,
-        should_parse_callback: Optional[callable] = None
+        should_parse_callback: Optional[callable] = None,
+        workers: Optional[int] = None,
+        processes: bool = False
     ) -> List[CodeSnippet]:
-        """Parses all supported files in a directory"""
-        all_snippets = []
-        
+        """
+        Parses all supported files in a directory.
+        Files are parsed concurrently on a thread pool (tree-sitter releases the GIL), or on a
+        process pool when `processes` is set; results keep the directory walk order.
+        Process workers keep their trees to themselves, so this factory's parser caches stay empty
+        and relationship extraction has to parse those files again; the indexer uses threads for that reason.
+        """
         default_ignore_dirs = {".git", "__pycache__", "node_modules", ".venv", "venv"}
         default_ignore_exts = {".pyc", ".pyo", ".so", ".dll", ".exe", ".bin"}
             
         ignore_dirs_set = default_ignore_dirs.union(set(ignore_dirs)) if ignore_dirs else default_ignore_dirs
         ignore_exts_set = default_ignore_exts.union(set(ignore_exts)) if ignore_exts else default_ignore_exts
 
-        for root, dirs, files in os.walk(directory_path):
-            dirs[:] = [d for d in dirs if d not in ignore_dirs_set]
-            
-            for file in files:
-                file_path = os.path.join(root, file)
-                extension = f".{file.split('.')[-1]}" if "." in file else ""
-                
-                if extension in ignore_exts_set:
-                    continue
-                    
-                parser = self.get_parser_for_file(file_path)
+        tasks = []
+        for file_path in self._scan_files(directory_path, recursive, ignore_dirs_set, ignore_exts_set):
+            parser = self.get_parser_for_file(file_path)
+            if parser:
+                tasks.append((file_path, parser))
+
+        if processes:
+            return self._parse_with_processes(tasks, should_parse_callback, workers)
+
+        all_snippets = []
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            for snippets in executor.map(lambda task: self._parse_file(*task, should_parse_callback), tasks):
+                all_snippets.extend(snippets)
                 
-                if parser:
-                    try:
-                        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                            content = f.read()
-                        
-                        import hashlib
-                        content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
-                        
-                        snippets = None
-                        if should_parse_callback:
-                            snippets = should_parse_callback(file_path, content_hash)
-                        
-                        if snippets is None:
-                            logger.info(f"Parsing file: {file_path}")
-                            snippets = parser.parse_file(content, file_path)
-                        else:
-                            logger.info(f"Skipping parsing for unchanged file: {file_path}")
-                            
-                        all_snippets.extend(snippets)
-                    except Exception as e:
-                        logger.error(f"Error parsing {file_path}: {e}")
+        return all_snippets
+
+    def _parse_with_processes(self, tasks: List[Tuple[str, BaseParser]], should_parse_callback: Optional[callable], workers: Optional[int]) -> List[CodeSnippet]:
+        """Reads files and runs the callback on threads, then parses the remaining files in worker processes"""
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+            prepared = list(executor.map(lambda task: self._prepare_file(task[0], should_parse_callback), tasks))
+
+        to_parse = [(file_path, content, content_hash) for file_path, content, content_hash, snippets in filter(None, prepared) if snippets is None]
+        parsed: Dict[str, List[CodeSnippet]] = {}
+        if to_parse:
+            logger.info(f"Parsing {len(to_parse)} files in worker processes")
+            # spawn, because forking a process that already runs threads (server, embedding worker) can deadlock
+            with ProcessPoolExecutor(
+                max_workers=workers or os.cpu_count(),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.chunk_size,)
+            ) as pool:
+                results = pool.map(_parse_in_worker, to_parse, chunksize=PROCESS_CHUNK_SIZE)
+                parsed = {task[0]: snippets for task, snippets in zip(to_parse, results)}
+
+        all_snippets = []
+        for item in filter(None, prepared):
+            file_path, _, _, snippets = item
+            all_snippets.extend(snippets if snippets is not None else parsed[file_path])
+        return all_snippets
+
+    def _scan_files(self, directory_path: str, recursive: bool, ignore_dirs: set, ignore_exts: set):
+        """Yields candidate file paths using os.scandir, whose entries carry cached type/stat info"""
+        subdirs = []
+        try:
+            with os.scandir(directory_path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in ignore_dirs:
+                            subdirs.append(entry.path)
+                        continue
+                    if not entry.is_file():
+                        continue
+
+                    extension = f".{entry.name.split('.')[-1]}" if "." in entry.name else ""
+                    if extension in ignore_exts:
+                        continue
+
+                    if entry.stat().st_size > MAX_FILE_SIZE:
+                        logger.info(f"Skipping oversized file: {entry.path}")
+                        continue
+                    yield entry.path
+        except OSError as e:
+            logger.error(f"Error scanning {directory_path}: {e}")
+            return
+
+        if recursive:
+            for subdir in subdirs:
+                yield from self._scan_files(subdir, recursive, ignore_dirs, ignore_exts)
+
+    def _prepare_file(self, file_path: str, should_parse_callback: Optional[callable]) -> Optional[Tuple[str, str, str, Optional[List[CodeSnippet]]]]:
+        """
+        Reads a file and asks the callback for stored snippets.
+        Returns (file_path, content, content_hash, stored snippets or None), or None for binary/unreadable files.
+        """
+        try:
+            with open(file_path, 'rb') as f:
+                raw = f.read()
+        except OSError as e:
+            logger.error(f"Error reading {file_path}: {e}")
+            return None
+
+        if b"\0" in raw[:BINARY_SNIFF_SIZE]:
+            logger.info(f"Skipping binary file: {file_path}")
+            return None
+        
+        content = raw.decode("utf-8", errors="ignore")
+        content_hash = hashlib.sha256(raw).hexdigest()
+        
+        snippets = None
+        if should_parse_callback:
+            snippets = should_parse_callback(file_path, content_hash)
+            if snippets is not None:
+                logger.info(f"Skipping parsing for unchanged file: {file_path}")
+        return file_path, content, content_hash, snippets
+
+    def _parse_file(self, file_path: str, parser: BaseParser, should_parse_callback: Optional[callable]) -> List[CodeSnippet]:
+        """Reads and parses a single file, reusing stored snippets when the callback provides them"""
+        try:
+            prepared = self._prepare_file(file_path, should_parse_callback)
+            if prepared is None:
+                return []
+            _, content, content_hash, snippets = prepared
             
-            if not recursive:
-                break
+            if snippets is None:
+                # parse_file serves unchanged content from the parser's in-memory cache
+                logger.info(f"Parsing file: {file_path}")
+                snippets = parser.parse_file(content, file_path, content_hash=content_hash)
                 
-        return all_snippets
+            return snippets
+        except Exception as e:
+            logger.error(f"Error parsing {file_path}: {e}")
+            return []
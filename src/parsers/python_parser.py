@@ -1,21 +1,44 @@
 import tree_sitter_python as tspython
+import heapq
 import logging
-from tree_sitter import Language, Parser
-from typing import List, Optional, Any
-from src.parsers.base_parser import BaseParser
+from dataclasses import dataclass, field
+from tree_sitter import Language
+from typing import List, Optional, Any, Dict
+from src.parsers.base_parser import BaseParser, hash_bytes, hash_fields
 from src.IR.models import CodeSnippet, SnippetType
-import hashlib
-from tree_sitter import Query, QueryCursor
+from tree_sitter import Query
 
 from src.parsers.chunker import CodeChunker
 
 logger = logging.getLogger(__name__)
 
+PY_LANGUAGE = Language(tspython.language())
+
+@dataclass(slots=True)
+class ParseContext:
+    """Per-parse lookups shared by every snippet of a file, keyed by tree-sitter node id."""
+    enclosing_classes: Dict[int, Any]
+    leading_comments: Dict[int, List[Any]]
+    parent_hashes: Dict[int, str] = field(default_factory=dict)
+
 class PythonParser(BaseParser):
+    QUERY = """
+    (class_definition
+      name: (identifier) @class.name
+      body: (block) @class.body) @class.def
+
+    (function_definition
+      name: (identifier) @function.name
+      parameters: (parameters) @function.params
+      body: (block) @function.body) @function.def
+    """
+    # The query text is constant, so it is compiled once and shared by every instance
+    COMPILED_QUERY = Query(PY_LANGUAGE, QUERY)
+
     def __init__(self, chunk_size: int = 500, llm: Optional[Any] = None):
         super().__init__(chunk_size=chunk_size, llm=llm)
-        self.language = Language(tspython.language())
-        self.parser = Parser(self.language)
+        self.language = PY_LANGUAGE
+        self._query = self.COMPILED_QUERY
         self.chunker = CodeChunker(language="python", chunk_max_characters=chunk_size)
 
     @property
@@ -23,67 +46,106 @@ class PythonParser(BaseParser):
         return "python"
 
     def get_query(self) -> str:
-        return """
-        (class_definition
-          name: (identifier) @class.name
-          body: (block) @class.body) @class.def
-
-        (function_definition
-          name: (identifier) @function.name
-          parameters: (parameters) @function.params
-          body: (block) @function.body) @function.def
-        """
+        return self.QUERY
 
-    def parse_file(self, code: str, file_path: Optional[str] = None) -> List[CodeSnippet]:
+    def parse_file(self, code: str, file_path: Optional[str] = None, content_hash: Optional[str] = None) -> List[CodeSnippet]:
+        # Node offsets are byte offsets, so all slicing happens on the encoded source.
+        # A known content hash lets an unchanged file return before the source is even encoded
+        code_bytes = None if content_hash is not None else code.encode("utf-8")
         if file_path:
-            cached = self.get_cached_snippets(file_path, code)
+            cached = self.get_cached_snippets(file_path, code, code_bytes, content_hash=content_hash)
             if cached is not None:
                 return cached
+        if code_bytes is None:
+            code_bytes = code.encode("utf-8")
 
-        old_tree = self._tree_cache.get(file_path) if file_path else None
+        entry = self.get_file_cache(file_path) if file_path else None
+        old_tree = entry.tree if entry else None
         
         if old_tree:
-            tree = self.parser.parse(bytes(code, "utf8"), old_tree)
+            tree = self.parser.parse(code_bytes, old_tree)
         else:
-            tree = self.parser.parse(bytes(code, "utf8"))
+            tree = self.parser.parse(code_bytes)
         
-        if file_path:
-            self._tree_cache[file_path] = tree
-            self._code_cache[file_path] = code
+        if entry:
+            entry.tree = tree
+            entry.code = code
 
-        query = Query(self.language, self.get_query())
-        cursor = QueryCursor(query)
-        captures_dict = cursor.captures(tree.root_node)
+        captures_dict = self.query_cursor.captures(tree.root_node)
         
-        # Flatten and sort captures for consistent processing
-        all_captures = []
-        for tag, nodes in captures_dict.items():
-            for node in nodes:
-                all_captures.append((node, tag))
-        all_captures.sort(key=lambda x: x[0].start_byte)
+        # Each capture list is already in document order, so merging keeps the definitions sorted
+        definitions = list(heapq.merge(
+            ((node, "class.def") for node in captures_dict.get("class.def", [])),
+            ((node, "function.def") for node in captures_dict.get("function.def", [])),
+            key=lambda capture: capture[0].start_byte
+        ))
 
         snippets = []
-        for node, tag in all_captures:
-            if tag in ["class.def", "function.def"]:
-                extracted = self._extract_snippets(node, tag, code, file_path)
-                snippets.extend(extracted)
+        ctx = ParseContext(
+            enclosing_classes=self._build_enclosing_class_map(definitions),
+            leading_comments=self._build_comment_map(definitions)
+        )
+        for node, tag in definitions:
+            snippets.extend(self._extract_snippets(node, tag, code_bytes, file_path, ctx))
         
         if file_path:
             self.cache_snippets(file_path, snippets)
             
         return snippets
 
-    def _extract_snippets(self, node, tag, code, file_path) -> List[CodeSnippet]:
-        full_content = code[node.start_byte:node.end_byte]
+    def _build_enclosing_class_map(self, definitions) -> Dict[int, Any]:
+        """
+        Maps each captured definition's node id to its nearest enclosing class_definition.
+        Definitions are sorted by start byte and nest, so a stack of open classes
+        replaces a `node.parent` walk per definition.
+        """
+        enclosing: Dict[int, Any] = {}
+        open_classes = []
+        for node, tag in definitions:
+            while open_classes and open_classes[-1].end_byte <= node.start_byte:
+                open_classes.pop()
+            if open_classes:
+                enclosing[node.id] = open_classes[-1]
+            if tag == "class.def":
+                open_classes.append(node)
+        return enclosing
+
+    def _build_comment_map(self, definitions) -> Dict[int, List[Any]]:
+        """
+        Maps each captured definition's node id to the run of comment nodes directly preceding it.
+        Each parent's children are fetched once instead of walking `prev_sibling` per definition.
+        """
+        def_ids = {node.id for node, _ in definitions}
+        comment_map: Dict[int, List[Any]] = {}
+        seen_parents = set()
+        for node, _ in definitions:
+            parent = node.parent
+            if parent is None or parent.id in seen_parents:
+                continue
+            seen_parents.add(parent.id)
+
+            run = []
+            for child in parent.children:
+                if child.type == "comment":
+                    run.append(child)
+                    continue
+                if run and child.id in def_ids:
+                    comment_map[child.id] = run
+                run = []
+        return comment_map
+
+    def _extract_snippets(self, node, tag, code_bytes, file_path, ctx: ParseContext) -> List[CodeSnippet]:
+        full_content = code_bytes[node.start_byte:node.end_byte].decode("utf-8")
         
         # For classes, we always want a skeleton as the main node
         if tag == "class.def":
             body_node = node.child_by_field_name("body")
-            header_content = code[node.start_byte:body_node.start_byte] if body_node else full_content
             
-            # Reconstruction logic for class skeleton to include method definitions
-            skeleton_parts = [header_content]
+            # Reconstruction logic for class skeleton to include method definitions.
+            # Ranges are copied from a memoryview straight into one growing buffer
             if body_node:
+                source = memoryview(code_bytes)
+                skeleton = bytearray(source[node.start_byte:body_node.start_byte])
                 last_idx = body_node.start_byte
                 # Find top-level definitions inside the class (methods/nested classes)
                 for child in body_node.children:
@@ -97,113 +159,84 @@ class PythonParser(BaseParser):
                     
                     if target.type in ["function_definition", "class_definition"]:
                         # Append text between last definition and this one (comments, indentation)
-                        skeleton_parts.append(code[last_idx:target.start_byte])
+                        skeleton += source[last_idx:target.start_byte]
                         
                         # Append the definition skeleton (signature)
                         c_body = target.child_by_field_name("body")
                         if c_body:
                             # Use everything up to the body
-                            child_skel = code[target.start_byte:c_body.start_byte].strip()
-                            skeleton_parts.append(child_skel)
-                            skeleton_parts.append("\n        ... # implementation hidden ...")
+                            skeleton += code_bytes[target.start_byte:c_body.start_byte].strip()
+                            skeleton += b"\n        ... # implementation hidden ..."
                         else:
-                            skeleton_parts.append(code[target.start_byte:target.end_byte])
+                            skeleton += source[target.start_byte:target.end_byte]
                         last_idx = target.end_byte
                 
                 # Append the rest of the class body
-                skeleton_parts.append(code[last_idx:node.end_byte])
-                skeleton_content = "".join(skeleton_parts)
+                skeleton += source[last_idx:node.end_byte]
+                skeleton_content = skeleton.decode("utf-8")
             else:
-                skeleton_content = header_content
+                skeleton_content = full_content
 
-            snippet = self._create_snippet(node, tag, code, file_path, full_content, override_content=skeleton_content)
+            snippet = self._create_snippet(node, tag, code_bytes, file_path, ctx, full_content, override_content=skeleton_content)
             snippet.is_skeleton = True
             return [snippet]
         
         # For functions, check if they are too large
         if len(full_content) <= self.chunk_size:
-            snippet = self._create_snippet(node, tag, code, file_path, full_content)
+            snippet = self._create_snippet(node, tag, code_bytes, file_path, ctx, full_content)
             return [snippet]
         
         # If chunking, the parent becomes a skeleton
         body_node = node.child_by_field_name("body")
-        skeleton_content = code[node.start_byte:body_node.start_byte] if body_node else full_content
-        parent_snippet = self._create_snippet(node, tag, code, file_path, full_content, override_content=skeleton_content)
+        skeleton_content = code_bytes[node.start_byte:body_node.start_byte].decode("utf-8") if body_node else full_content
+        parent_snippet = self._create_snippet(node, tag, code_bytes, file_path, ctx, full_content, override_content=skeleton_content)
         parent_snippet.is_skeleton = True
         
-        nodes = self.chunker.chunk_to_nodes(full_content)
+        chunks = self.chunker.chunk_node(node, body_node, code_bytes)
         
         snippets = [parent_snippet]
-        for i, text_node in enumerate(nodes):
-            display_name = None
-            if "inclusive_scopes" in text_node.metadata and text_node.metadata["inclusive_scopes"]:
-                scopes = text_node.metadata["inclusive_scopes"]
-                display_name = scopes[-1]["name"]
-            
+        for i, chunk in enumerate(chunks):
             # Chunks use their own content for ID but point to the parent
-            chunk_content = text_node.get_content()
-            snippet = self._create_snippet(node, tag, code, file_path, chunk_content, chunk_index=i)
+            snippet = self._create_snippet(node, tag, code_bytes, file_path, ctx, chunk.text, chunk_index=i)
             snippet.parent_id = parent_snippet.id
             
-            if display_name:
-                snippet.name = f"{display_name}_chunk_{i}"
+            if chunk.scope_name:
+                snippet.name = f"{chunk.scope_name}_chunk_{i}"
             
-            snippet.metadata["llama_index_node_id"] = text_node.node_id
-            if text_node.parent_node:
-                snippet.metadata["llama_index_parent_id"] = text_node.parent_node.node_id
+            snippet.metadata["chunk_start_byte"] = chunk.start_byte
+            snippet.metadata["chunk_end_byte"] = chunk.end_byte
             
             snippets.append(snippet)
         
         return snippets
 
-    def _create_snippet(self, node, tag, code, file_path, content_for_id, chunk_index: Optional[int] = None, override_content: Optional[str] = None) -> CodeSnippet:
-        # Make ID unique to this specific file and location to avoid collisions with identical code
-        id_base = f"{file_path}:{node.start_byte}:{chunk_index}:{content_for_id}"
-        snippet_id = hashlib.sha256(id_base.encode("utf-8")).hexdigest()
+    def _create_snippet(self, node, tag, code_bytes, file_path, ctx: ParseContext, content_for_id, chunk_index: Optional[int] = None, override_content: Optional[str] = None) -> CodeSnippet:
+        # The file and byte range identify a snippet within a parse, so the content itself is not hashed
+        snippet_id = hash_fields(file_path, node.start_byte, node.end_byte, chunk_index)
         actual_content = override_content if override_content is not None else content_for_id
 
-        cached_meta = self._metadata_cache.get(snippet_id)
-        if cached_meta:
-            return CodeSnippet(
-                id=snippet_id,
-                name=cached_meta["name"],
-                type=cached_meta["type"],
-                content=actual_content,
-                parent_id=cached_meta["parent_id"],
-                docstring=cached_meta["docstring"],
-                signature=cached_meta["signature"],
-                file_path=file_path,
-                start_line=node.start_point[0],
-                end_line=node.end_point[0],
-                start_byte=node.start_byte,
-                end_byte=node.end_byte,
-                is_skeleton=override_content is not None,
-                metadata={"chunk_index": chunk_index, "ts_node_id": node.id} if chunk_index is not None else {"ts_node_id": node.id}
-            )
-
         snippet_type = SnippetType.CLASS if "class" in tag else SnippetType.FUNCTION
         
         parent_id = None
-        curr = node.parent
-        while curr:
-            if curr.type == "class_definition":
-                if snippet_type == SnippetType.FUNCTION:
-                    snippet_type = SnippetType.METHOD
-                
-                parent_content = code[curr.start_byte:curr.end_byte]
-                parent_id = hashlib.sha256(parent_content.encode("utf-8")).hexdigest()
-                break
-            curr = curr.parent
+        parent_class = ctx.enclosing_classes.get(node.id)
+        if parent_class is not None:
+            if snippet_type == SnippetType.FUNCTION:
+                snippet_type = SnippetType.METHOD
+            
+            parent_id = ctx.parent_hashes.get(parent_class.id)
+            if parent_id is None:
+                parent_id = hash_bytes(code_bytes[parent_class.start_byte:parent_class.end_byte])
+                ctx.parent_hashes[parent_class.id] = parent_id
 
         name_node = node.child_by_field_name("name")
-        name = code[name_node.start_byte:name_node.end_byte] if name_node else "anonymous"
+        name = code_bytes[name_node.start_byte:name_node.end_byte].decode("utf-8") if name_node else "anonymous"
         if chunk_index is not None:
             name = f"{name}_chunk_{chunk_index}"
         
         params = ""
         if snippet_type in [SnippetType.FUNCTION, SnippetType.METHOD]:
             params_node = node.child_by_field_name("parameters")
-            params = code[params_node.start_byte:params_node.end_byte] if params_node else "()"
+            params = code_bytes[params_node.start_byte:params_node.end_byte].decode("utf-8") if params_node else "()"
 
         docstring = ""
         body_node = node.child_by_field_name("body")
@@ -212,16 +245,20 @@ class PythonParser(BaseParser):
             if first_stmt.type == "expression_statement":
                 expr = first_stmt.children[0]
                 if expr.type == "string":
-                    docstring = code[expr.start_byte:expr.end_byte].strip('\"\'')
+                    parts = expr.children
+                    if len(parts) >= 2 and parts[0].type == "string_start" and parts[-1].type == "string_end":
+                        # Text between the delimiters, prefixes (r, b, f) and quotes excluded
+                        docstring = code_bytes[parts[0].end_byte:parts[-1].start_byte].decode("utf-8")
+                    else:
+                        docstring = code_bytes[expr.start_byte:expr.end_byte].decode("utf-8").strip('\"\'')
 
-        comments = []
-        prev = node.prev_sibling
-        while prev and prev.type == "comment":
-            comments.append(code[prev.start_byte:prev.end_byte].strip("# ").strip())
-            prev = prev.prev_sibling
+        comments = [
+            code_bytes[c.start_byte:c.end_byte].decode("utf-8").strip("# ").strip()
+            for c in ctx.leading_comments.get(node.id, ())
+        ]
         
         if comments:
-            leading_comment = "\n".join(reversed(comments))
+            leading_comment = "\n".join(comments)
             if docstring:
                 docstring = leading_comment + "\n" + docstring
             else:
@@ -229,14 +266,6 @@ class PythonParser(BaseParser):
 
         signature = f"{name}{params}" if snippet_type in [SnippetType.FUNCTION, SnippetType.METHOD] else name
 
-        self._metadata_cache[snippet_id] = {
-            "name": name,
-            "type": snippet_type,
-            "parent_id": parent_id,
-            "docstring": docstring if docstring else None,
-            "signature": signature
-        }
-
         metadata = {"ts_node_id": node.id}
         if chunk_index is not None:
             metadata["chunk_index"] = chunk_index
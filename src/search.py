@@ -1,13 +1,37 @@
+import asyncio
+import copy
+import functools
 import logging
+import threading
 import time
+from collections import OrderedDict
 from typing import List, Dict, Any, Optional, Tuple
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
 from src.indexer import ProjectIndexer
+from src.storage.chroma_storage import VectorHits
 from src.model.orchestrator import Orchestrator
 from src.model.reranker import get_reranker
+from src.model.embedding_cache import CachedEmbedder
 
 logger = logging.getLogger(__name__)
 
+# Answer prompts kept for re-asking or re-streaming the same results
+PROMPT_CACHE_SIZE = 32
+# Worker threads shared by all searches for the blocking pipeline stages
+SEARCH_WORKERS = 8
+# Completed searches served again to duplicate requests (retries, several open tabs) within the TTL
+RESULT_CACHE_SIZE = 256
+RESULT_CACHE_TTL = 60.0
+# Cosine distance gap between the best hit and hit n_results*2 above which the vector ranking is
+# considered decisive, and only those leading hits are hydrated and reranked
+RERANK_GAP_THRESHOLD = 0.2
+# Results reused for a new query whose embedding is at least this cosine-similar to a cached one
+SEMANTIC_CACHE_SIMILARITY = 0.95
+SEMANTIC_CACHE_SIZE = 256
+# Random hyperplanes hashing query embeddings into 2^bits LSH buckets; only one bucket is scanned per lookup
+SEMANTIC_CACHE_BITS = 8
+
 ANSWER_PROMPT = """You are an expert software engineer assistant. Answer the user's question about the codebase based on the provided code snippets and their context.
 
 User Question: {query}
@@ -24,21 +48,179 @@ Instructions:
 
 Answer:"""
 
+# ANSWER_PROMPT split around its placeholders once, so building a prompt is a plain concatenation
+_PROMPT_HEAD, _rest = ANSWER_PROMPT.split("{query}", 1)
+_PROMPT_MID, _PROMPT_TAIL = _rest.split("{snippets_context}", 1)
+del _rest
+assert f"{_PROMPT_HEAD}X{_PROMPT_MID}Y{_PROMPT_TAIL}" == ANSWER_PROMPT.format(query="X", snippets_context="Y")
+
+class SemanticResultCache:
+    """
+    Search results keyed by query embedding. Embeddings are bucketed by the signs of their
+    projections on random hyperplanes, and a lookup only compares against its own bucket.
+    Expects unit-norm embeddings, so the dot product is the cosine similarity.
+    """
+
+    def __init__(self, capacity: int = SEMANTIC_CACHE_SIZE, threshold: float = SEMANTIC_CACHE_SIMILARITY, bits: int = SEMANTIC_CACHE_BITS):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.bits = bits
+        self._hyperplanes: Optional[np.ndarray] = None
+        # Entry id -> (bucket, n_results, embedding, result), in LRU order
+        self._entries: "OrderedDict[int, Tuple[bytes, int, np.ndarray, Dict[str, Any]]]" = OrderedDict()
+        self._buckets: Dict[bytes, List[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _bucket(self, vec: np.ndarray) -> bytes:
+        if self._hyperplanes is None or self._hyperplanes.shape[0] != vec.shape[0]:
+            # Fixed seed keeps the buckets stable for the lifetime of the process
+            self._hyperplanes = np.random.default_rng(0).standard_normal((vec.shape[0], self.bits)).astype(np.float32)
+            self._entries.clear()
+            self._buckets.clear()
+        return np.packbits(vec @ self._hyperplanes > 0).tobytes()
+
+    def get(self, vec: np.ndarray, n_results: int) -> Optional[Dict[str, Any]]:
+        """Returns a copy of the most similar cached result above the threshold, if any."""
+        with self._lock:
+            best_id, best_sim = None, self.threshold
+            for entry_id in self._buckets.get(self._bucket(vec), ()):
+                _, entry_n, entry_vec, _ = self._entries[entry_id]
+                if entry_n != n_results:
+                    continue
+                sim = float(entry_vec @ vec)
+                if sim >= best_sim:
+                    best_id, best_sim = entry_id, sim
+            if best_id is None:
+                return None
+            self._entries.move_to_end(best_id)
+            result = self._entries[best_id][3]
+        logger.debug(f"Semantic cache hit (cosine {best_sim:.3f})")
+        return copy.deepcopy(result)
+
+    def put(self, vec: np.ndarray, n_results: int, result: Dict[str, Any]):
+        with self._lock:
+            bucket = self._bucket(vec)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (bucket, n_results, vec, result)
+            self._buckets.setdefault(bucket, []).append(entry_id)
+            while len(self._entries) > self.capacity:
+                old_id, (old_bucket, *_) = self._entries.popitem(last=False)
+                self._buckets[old_bucket].remove(old_id)
+                if not self._buckets[old_bucket]:
+                    del self._buckets[old_bucket]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
 class SearchManager:
-    def __init__(self, indexer: ProjectIndexer, orchestrator: Optional[Orchestrator] = None, use_reranker: bool = True):
+    def __init__(self, indexer: ProjectIndexer, orchestrator: Optional[Orchestrator] = None, use_reranker: bool = True, executor: Optional[ThreadPoolExecutor] = None):
+        """
+        executor runs the blocking pipeline stages. When omitted, the manager creates its own
+        and shuts it down in close(); an injected executor is left to its owner.
+        """
         self.indexer = indexer
         self.llm = indexer.llm
-        self.embedding_model = indexer.embedding_model
+        # Query embeddings are cached in memory and persisted in SQLite next to the index
+        self.embedding_model = CachedEmbedder(indexer.embedding_model, store=indexer.sqlite) if indexer.embedding_model else None
         self.sqlite = indexer.sqlite
         self.graph_db = indexer.graph_db
         self.chroma = indexer.chroma
         self.orchestrator = orchestrator
         self.reranker = get_reranker() if use_reranker else None
+        self._prompts: "OrderedDict[Tuple, str]" = OrderedDict()
+        self._prompts_lock = threading.Lock()
+        # (query, n_results) -> (completion time, result) and -> future of the search currently running
+        self._results: "OrderedDict[Tuple[str, int], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, int], Future] = {}
+        self._results_lock = threading.Lock()
+        self._semantic_cache = SemanticResultCache()
+        # Set once the collection is seen non-empty, so later searches skip the count() round-trip
+        self._known_nonempty = False
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="search")
+        # Separate pool for the relations query issued from inside a pipeline stage, so it never waits on its own pool
+        self._hydration_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="search-hydrate")
+
+    def close(self):
+        """Shuts down the worker threads owned by this manager."""
+        if self._owns_executor:
+            self._executor.shutdown(wait=False)
+        self._hydration_executor.shutdown(wait=False)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
 
     def search(self, query: str, n_results: int = 5) -> Dict[str, Any]:
+        """
+        Synchronous entry point, runs search_async on a fresh event loop.
+        Identical concurrent searches share one run, and completed results are reused for
+        RESULT_CACHE_TTL seconds. Every caller gets its own deep copy.
+        """
+        key = (query, n_results)
+        with self._results_lock:
+            cached = self._results.get(key)
+            if cached is not None and time.monotonic() - cached[0] < RESULT_CACHE_TTL:
+                self._results.move_to_end(key)
+                return copy.deepcopy(cached[1])
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+
+        if not leader:
+            logger.debug(f"Joining in-flight search for: {query}")
+            return copy.deepcopy(future.result())
+
+        try:
+            result = asyncio.run(self.search_async(query, n_results))
+        except BaseException as e:
+            with self._results_lock:
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self._results_lock:
+            self._inflight.pop(key, None)
+            self._results[key] = (time.monotonic(), result)
+            while len(self._results) > RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+        future.set_result(result)
+        return copy.deepcopy(result)
+
+    def is_indexed(self) -> bool:
+        """Returns whether the vector collection holds any snippets, counting only until it first does."""
+        if self._known_nonempty:
+            return True
+        if self.chroma.collection.count() == 0:
+            return False
+        self._known_nonempty = True
+        return True
+
+    def on_index_updated(self):
+        """Drops cached search results and the known-indexed flag after the index changed."""
+        self._known_nonempty = False
+        with self._results_lock:
+            self._results.clear()
+        self._semantic_cache.clear()
+
+    async def _in_executor(self, fn, *args, **kwargs):
+        """Runs a blocking call on the shared search executor (unlike asyncio.to_thread, whose pool dies with the loop)."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def search_async(self, query: str, n_results: int = 5) -> Dict[str, Any]:
         """
         Performs a hybrid search (Semantic + Keyword) with RRF fusion and Re-ranking.
-        Uses parallel execution to speed up the pipeline.
+        The blocking stages (HyDE, SQLite keyword search, embedding + Chroma) run as concurrent
+        tasks in worker threads so all their waits overlap. The original query is embedded while
+        HyDE runs; that embedding first looks up the semantic result cache, and is reused for the
+        vector search whenever HyDE leaves the query unchanged.
         """
         start_time = time.time()
         if not self.chroma or not self.embedding_model:
@@ -47,60 +229,62 @@ class SearchManager:
 
         to_rerank_count = max(n_results * 10, 100)
         
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            hyde_future = executor.submit(self._orchestrate_query, query)
-            keyword_future = executor.submit(self.sqlite.search_by_content, query, limit=to_rerank_count) if self.sqlite else None
-            
-            final_query, hyde_used = hyde_future.result()
-            
-            vector_future = executor.submit(self._retrieve_vector_candidates, final_query, to_rerank_count)
-            hyde_keyword_future = None
-            if hyde_used and self.sqlite:
-                hyde_keyword_future = executor.submit(self.sqlite.search_by_content, final_query, limit=to_rerank_count)
-            
-            vector_results = vector_future.result()
-            
-            keyword_results_list = []
-            seen_ids = set()
-            
-            if keyword_future:
-                for s in keyword_future.result():
-                    if s.id not in seen_ids:
-                        keyword_results_list.append({
-                            "id": s.id, 
-                            "document": s.to_embeddable_text(use_summary=True)
-                        })
-                        seen_ids.add(s.id)
-            
-            if hyde_keyword_future:
-                for s in hyde_keyword_future.result():
-                    if s.id not in seen_ids:
-                        keyword_results_list.append({
-                            "id": s.id, 
-                            "document": s.to_embeddable_text(use_summary=True)
-                        })
-                        seen_ids.add(s.id)
+        hyde_task = asyncio.create_task(self._in_executor(self._orchestrate_query, query))
+        embed_task = asyncio.create_task(self._in_executor(self._embed_query, query))
+        keyword_tasks = []
+        if self.sqlite:
+            keyword_tasks.append(asyncio.create_task(self._in_executor(self.sqlite.search_by_content, query, limit=to_rerank_count)))
+        
+        query_vec = await embed_task
+        if query_vec.size:
+            cached = self._semantic_cache.get(query_vec, n_results)
+            if cached is not None:
+                for task in (hyde_task, *keyword_tasks):
+                    task.cancel()
+                logger.info(f"Hybrid Search served from the semantic cache in {time.time() - start_time:.2f}s")
+                return cached
+
+        final_query, hyde_used = await hyde_task
+        
+        vector_tasks = []
+        if hyde_used:
+            vector_tasks.append(self._in_executor(self._retrieve_vector_candidates, final_query, to_rerank_count))
+        if not hyde_used or query_vec.size:
+            # With HyDE, the original query's embedding (already computed) adds a second semantic ranking to the fusion
+            vector_tasks.append(self._in_executor(self.chroma.query, query_vec, n_results=to_rerank_count))
+        if hyde_used and self.sqlite:
+            keyword_tasks.append(self._in_executor(self.sqlite.search_by_content, final_query, limit=to_rerank_count))
+        
+        retrieved = await asyncio.gather(*vector_tasks, *keyword_tasks)
+        vector_results = retrieved[:len(vector_tasks)]
+        keyword_results_list = self._merge_keyword_results(retrieved[len(vector_tasks):])
 
         # 3. Fusion (Reciprocal Rank Fusion)
-        sorted_ids = self._fuse_results(vector_results, keyword_results_list)
+        keyword_ids = [r["id"] for r in keyword_results_list]
+        sorted_ids = self._fuse_results(*(hits.ids for hits in vector_results), keyword_ids)
+        rerank_ids = self._rerank_pool(sorted_ids, vector_results[0], keyword_ids, n_results, to_rerank_count)
         
         # 4. Hydration & Re-ranking
-        final_results = self._hydrate_and_rerank(sorted_ids[:to_rerank_count], vector_results, keyword_results_list, query, n_results)
+        final_results = await self._in_executor(
+            self._hydrate_and_rerank, rerank_ids, vector_results, keyword_results_list, query, n_results
+        )
 
         logger.info(f"Hybrid Search complete in {time.time() - start_time:.2f}s")
-        return {
+        result = {
             "results": final_results,
             "final_query": final_query,
             "hyde_used": hyde_used
         }
+        if query_vec.size:
+            self._semantic_cache.put(query_vec, n_results, copy.deepcopy(result))
+        return result
 
     def answer_query(self, query: str, results: List[Dict[str, Any]]) -> str:
         """Generates a complete answer using the LLM."""
         if not self.llm: return "LLM not available."
         if not results: return "No search results found."
 
-        context = self._build_context_string(results)
-        prompt = ANSWER_PROMPT.format(query=query, snippets_context=context)
+        prompt = self.prepare_prompt(query, results)
         
         logger.info("Generating answer with Gemini...")
         return self.llm.complete(prompt)
@@ -114,8 +298,7 @@ class SearchManager:
             yield "No search results found."
             return
 
-        context = self._build_context_string(results)
-        prompt = ANSWER_PROMPT.format(query=query, snippets_context=context)
+        prompt = self.prepare_prompt(query, results)
         
         logger.info("Streaming answer with Gemini...")
         yield from self.llm.stream_complete(prompt)
@@ -130,99 +313,139 @@ class SearchManager:
         final_query = self.orchestrator.process_query(query)
         return final_query, (final_query != query)
 
-    def _retrieve_vector_candidates(self, final_query: str, limit: int) -> List[Dict]:
+    def _retrieve_vector_candidates(self, final_query: str, limit: int) -> VectorHits:
         """Helper for parallel vector retrieval."""
-        query_embedding = self.embedding_model.embed_text(final_query)
+        query_embedding = self._embed_query(final_query)
         return self.chroma.query(query_embedding, n_results=limit)
 
-    def _retrieve_candidates(self, original_query: str, final_query: str, hyde_used: bool, limit: int) -> Tuple[List[Dict], List[Dict]]:
-        # Legacy method for compatibility
-        vector_results = self._retrieve_vector_candidates(final_query, limit)
-        
+    def _embed_query(self, text: str) -> np.ndarray:
+        """Embeds a query through the cached embedder (read-only float32, empty on failure)."""
+        return self.embedding_model.embed_text(text)
+
+    def _retrieve_candidates(self, original_query: str, final_query: str, hyde_used: bool, limit: int) -> Tuple[VectorHits, List[Dict]]:
+        # Legacy method for compatibility, retrieves concurrently like search()
+        vector_future = self._executor.submit(self._retrieve_vector_candidates, final_query, limit)
         keyword_results = []
         if self.sqlite:
-            search_queries = [original_query]
-            if hyde_used:
-                search_queries.append(final_query)
-            
-            seen_ids = set()
-            for q in search_queries:
-                snippets = self.sqlite.search_by_content(q, limit=limit)
-                for s in snippets:
-                    if s.id not in seen_ids:
-                        keyword_results.append({
-                            "id": s.id, 
-                            "document": s.to_embeddable_text(use_summary=True)
-                        })
-                        seen_ids.add(s.id)
-        return vector_results, keyword_results
-
-    def _fuse_results(self, vector_results: List[Dict], keyword_results: List[Dict], k: int = 60) -> List[str]:
-        """Implements Reciprocal Rank Fusion (RRF)."""
-        combined_scores = {}
-        
-        for rank, res in enumerate(vector_results, 1):
-            combined_scores[res["id"]] = combined_scores.get(res["id"], 0) + (1.0 / (k + rank))
-            
-        for rank, res in enumerate(keyword_results, 1):
-            combined_scores[res["id"]] = combined_scores.get(res["id"], 0) + (1.0 / (k + rank))
+            search_queries = [original_query, final_query] if hyde_used else [original_query]
+            keyword_results = self._merge_keyword_results([self.sqlite.search_by_content_multi(search_queries, limit=limit)])
+        return vector_future.result(), keyword_results
 
-        return sorted(combined_scores.keys(), key=lambda x: combined_scores[x], reverse=True)
+    def _rerank_pool(self, sorted_ids: List[str], vector_results: VectorHits, keyword_ids: List[str], n_results: int, default: int) -> List[str]:
+        """
+        Picks the fused candidates to rerank. When the vector distances already separate the leading
+        n_results*2 hits, that ranking is cut to those hits instead of the fused list: the pool keeps them
+        plus every other candidate fused above the last of them, since the gap says nothing about keyword hits.
+        """
+        k = n_results * 2
+        distances = vector_results.distances
+        if distances.size <= k or distances[k] - distances[0] < RERANK_GAP_THRESHOLD:
+            logger.debug(f"Reranking {min(default, len(sorted_ids))} fused candidates")
+            return sorted_ids[:default]
 
-    def _hydrate_and_rerank(self, top_ids: List[str], vector_res: List[Dict], keyword_res: List[Dict], query: str, final_k: int) -> List[Dict]:
-        candidates = []
-        
-        # 1. Bulk hydrate snippet objects
+        leading = set(vector_results.ids[:k])
+        tail = set(vector_results.ids[k:]).difference(keyword_ids)
+        cut = max(i for i, sid in enumerate(sorted_ids) if sid in leading) + 1
+        pool = [sid for sid in sorted_ids[:cut] if sid not in tail]
+        logger.info(
+            f"Distance gap {distances[k] - distances[0]:.3f} at rank {k}: vector ranking truncated to its top {k}, "
+            f"reranking {len(pool)} fused candidates instead of {min(default, len(sorted_ids))}"
+        )
+        return pool
+
+    def _merge_keyword_results(self, result_lists: List[List[Any]]) -> List[Dict]:
+        """Concatenates keyword search results in order, keeping the first occurrence of each snippet."""
+        merged: Dict[str, Dict] = {}
+        for snippets in result_lists:
+            for s in snippets:
+                if s.id not in merged:
+                    merged[s.id] = {"id": s.id, "document": s.embeddable_text, "snippet": s}
+        return list(merged.values())
+
+    @staticmethod
+    def _documents_by_id(vector_res: List[VectorHits], keyword_res: List[Dict]) -> Dict[str, str]:
+        """Maps candidate ids to their retrieved document text, vector hits winning over keyword hits."""
+        doc_by_id = {r["id"]: r["document"] for r in keyword_res}
+        for hits in vector_res:
+            doc_by_id.update(zip(hits.ids, hits.documents))
+        return doc_by_id
+
+    def _fuse_results(self, *rankings: List[str], k: int = 60) -> List[str]:
+        """Implements Reciprocal Rank Fusion (RRF), vectorized over any number of ranked id lists."""
+        id_to_idx: Dict[str, int] = {}
+        indices = np.fromiter(
+            (id_to_idx.setdefault(sid, len(id_to_idx)) for ranked in rankings for sid in ranked),
+            dtype=np.intp, count=sum(len(ranked) for ranked in rankings)
+        )
+        # Reciprocal ranks of every list, laid out in the same order as `indices`
+        weights = 1.0 / (k + np.concatenate(
+            [np.arange(1, len(ranked) + 1, dtype=np.float64) for ranked in rankings] or [np.empty(0)]
+        ))
+        # bincount sums the weights per id in one pass (np.add.at is unbuffered and much slower)
+        scores = np.bincount(indices, weights=weights, minlength=len(id_to_idx))
+
+        # Stable sort keeps first-seen order among ties, like the previous sorted() call
+        ids = list(id_to_idx)
+        return [ids[i] for i in np.argsort(-scores, kind="stable")]
+
+    def _hydrate_and_rerank(self, top_ids: List[str], vector_res: List[VectorHits], keyword_res: List[Dict], query: str, final_k: int) -> List[Dict]:
         if not self.sqlite:
             return []
-            
-        snippet_map = self.sqlite.get_snippets(top_ids)
-        
-        for sid in top_ids:
-            snippet = snippet_map.get(sid)
-            if not snippet: continue
-
-            # Find the best available document text for reranking
-            doc_text = next((r["document"] for r in vector_res if r["id"] == sid), None)
-            if not doc_text:
-                doc_text = next((r["document"] for r in keyword_res if r["id"] == sid), None)
-            if not doc_text:
-                doc_text = snippet.to_embeddable_text(use_summary=True)
-            
-            candidates.append({
-                "id": sid,
-                "snippet": snippet,
-                "document": doc_text
-            })
 
-        # 2. Re-rank
-        if self.reranker and candidates:
-            logger.info(f"Reranking {len(candidates)} candidates...")
-            docs = [c["document"] for c in candidates]
-            reranked_meta = self.reranker.rerank(query, docs, top_n=final_k)
-            
-            # Reorder candidates based on reranker output
-            final_candidates = []
-            for meta in reranked_meta:
-                cand = candidates[meta["index"]]
-                cand["score"] = meta["score"]
-                final_candidates.append(cand)
-            candidates = final_candidates
-        else:
-            candidates = candidates[:final_k]
+        # 1. Re-rank on the document text retrieval already returned, without reading SQLite
+        doc_by_id = self._documents_by_id(vector_res, keyword_res)
+        # Keyword hits already carry full rows, so only vector-only survivors are read from SQLite
+        snippet_map = {r["id"]: r["snippet"] for r in keyword_res}
+        missing_docs = [sid for sid in top_ids if not doc_by_id.get(sid)]
+        if missing_docs:
+            # Rare: only these few are hydrated up front to get their text (to_embeddable_text is memoized)
+            fetched = self.sqlite.get_snippets(missing_docs)
+            snippet_map.update(fetched)
+            for sid, snippet in fetched.items():
+                doc_by_id[sid] = snippet.embeddable_text
+
+        ranked = [(sid, None) for sid in top_ids]
+        if self.reranker and top_ids:
+            logger.info(f"Reranking {len(top_ids)} candidates...")
+            docs = [doc_by_id.get(sid, "") for sid in top_ids]
+            # The full order is kept so ids missing from SQLite can be backfilled from the next ranks
+            reranked_meta = self.reranker.rerank(query, docs, top_n=len(docs))
+            ranked = [(top_ids[meta["index"]], meta["score"]) for meta in reranked_meta]
 
-        # 3. Bulk hydrate Parents & fetch Relations
+        # 2. Hydrate only the survivors
+        candidates = []
+        pos = 0
+        while len(candidates) < final_k and pos < len(ranked):
+            batch = ranked[pos:pos + final_k - len(candidates)]
+            pos += len(batch)
+            to_fetch = [sid for sid, _ in batch if sid not in snippet_map]
+            if to_fetch:
+                snippet_map.update(self.sqlite.get_snippets(to_fetch))
+            for sid, score in batch:
+                snippet = snippet_map.get(sid)
+                if not snippet: continue
+                candidates.append({
+                    "id": sid,
+                    "snippet": snippet,
+                    "document": doc_by_id.get(sid) or snippet.embeddable_text,
+                    "score": score
+                })
+
+        # 3. Bulk hydrate Parents & fetch Relations, the single graph query runs concurrently with the parent query
         results = []
         parent_ids = list(set(c["snippet"].parent_id for c in candidates if c["snippet"].parent_id))
-        parent_map = self.sqlite.get_snippets(parent_ids) if parent_ids else {}
+        relations_map = {}
+        if self.graph_db and candidates:
+            relations_future = self._hydration_executor.submit(self.graph_db.get_relationships_for, [c["snippet"].id for c in candidates])
+            parent_map = self.sqlite.get_snippets(parent_ids) if parent_ids else {}
+            relations_map = relations_future.result()
+        else:
+            parent_map = self.sqlite.get_snippets(parent_ids) if parent_ids else {}
 
         for c in candidates:
             snippet = c["snippet"]
             parent = parent_map.get(snippet.parent_id) if snippet.parent_id else None
-            
-            # Relations are still fetched per-snippet as they are usually few, 
-            # but we could bulk fetch if needed.
-            relations = self.graph_db.get_snippet_relationships(snippet.id) if self.graph_db else []
+            relations = relations_map.get(snippet.id, [])
             
             results.append({
                 "snippet": snippet,
@@ -234,25 +457,46 @@ class SearchManager:
             
         return results
 
+    def prepare_prompt(self, query: str, results: List[Dict[str, Any]]) -> str:
+        """
+        Builds the answer prompt shared by answer_query and stream_answer_query, so a retry with the
+        other one reuses it. Memoized on the query and the id, content hash, summary and score of each
+        result rather than object identity, since search() hands out copies.
+        """
+        key = (query, tuple((r["snippet"].id, r["snippet"].content_hash, r["snippet"].summary, r.get("score")) for r in results))
+        with self._prompts_lock:
+            prompt = self._prompts.get(key)
+            if prompt is not None:
+                self._prompts.move_to_end(key)
+                return prompt
+
+        start_time = time.time()
+        prompt = f"{_PROMPT_HEAD}{query}{_PROMPT_MID}{self._build_context_string(results)}{_PROMPT_TAIL}"
+        logger.debug(f"Answer context ready in {(time.time() - start_time) * 1000:.1f}ms ({len(prompt)} chars)")
+
+        with self._prompts_lock:
+            self._prompts[key] = prompt
+            while len(self._prompts) > PROMPT_CACHE_SIZE:
+                self._prompts.popitem(last=False)
+        return prompt
+
     def _build_context_string(self, results: List[Dict[str, Any]]) -> str:
-        context_parts = []
-        for i, res in enumerate(results, 1):
-            s = res["snippet"]
-            parent = res.get("parent")
-            relations = res.get("relations", [])
-            
-            parent_info = f" [in {parent.name} ({parent.type.value})]" if parent else ""
-            header = f"--- Snippet {i} [{s.name}{parent_info} at {s.file_path}:{s.start_line + 1}] ---"
-            
-            content = [header]
-            if s.summary:
-                content.append(f"Summary: {s.summary}")
-            
-            if relations:
-                rel_str = ", ".join([f"{r_type} {target}" for r_type, target in relations])
-                content.append(f"Relationships: {rel_str}")
-                
-            content.append(f"Code:\n{s.content}\n")
-            context_parts.append("\n".join(content))
+        return "\n".join([self._format_context_block(i, res) for i, res in enumerate(results, 1)])
+
+    def _format_context_block(self, i: int, res: Dict[str, Any]) -> str:
+        """Formats one snippet of the answer context with a single f-string."""
+        s = res["snippet"]
+        parent = res.get("parent")
+        relations = res.get("relations", [])
+        
+        parent_info = f" [in {parent.name} ({parent.type.value})]" if parent else ""
+        summary_line = f"Summary: {s.summary}\n" if s.summary else ""
+        relations_line = ""
+        if relations:
+            rel_str = ", ".join([f"{r_type} {target}" for r_type, target in relations])
+            relations_line = f"Relationships: {rel_str}\n"
             
-        return "\n".join(context_parts)
\ No newline at end of file
+        return (
+            f"--- Snippet {i} [{s.name}{parent_info} at {s.file_path}:{s.start_line + 1}] ---\n"
+            f"{summary_line}{relations_line}Code:\n{s.content}\n"
+        )
\ No newline at end of file
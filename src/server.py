@@ -1,6 +1,7 @@
 import os
 import logging
-import json
+import time
+import orjson
 from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from src.indexer import ProjectIndexer
@@ -9,6 +10,50 @@ from src.model.orchestrator import get_orchestrator
 
 logger = logging.getLogger(__name__)
 
+# Answer tokens after the first are sent in SSE frames of up to this many tokens...
+TOKEN_BATCH_SIZE = 8
+# ...or sooner once this many seconds passed since the last frame (checked as each token arrives)
+TOKEN_BATCH_WINDOW = 0.02
+
+# Most frames of a stream are answer tokens, so their envelope is pre-encoded and only the tokens are serialized
+_TOKENS_FRAME_HEAD = b'data: {"type":"tokens","tokens":'
+_TOKENS_FRAME_TAIL = b'}\n\n'
+_DONE_FRAME = b"data: [DONE]\n\n"
+
+def _sse(payload) -> bytes:
+    """Encodes one server-sent event frame."""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+def _coalesce_tokens(tokens):
+    """Yields lists of tokens: the first one alone (time to first token is unchanged), then small batches."""
+    batch = []
+    last_flush = time.monotonic()
+    first = True
+    for token in tokens:
+        batch.append(token)
+        now = time.monotonic()
+        if first or len(batch) >= TOKEN_BATCH_SIZE or now - last_flush >= TOKEN_BATCH_WINDOW:
+            yield batch
+            batch = []
+            last_flush = now
+            first = False
+    if batch:
+        yield batch
+
+def _format_snippets(results):
+    """Converts search results into the JSON snippet list shared by both search endpoints."""
+    return [
+        {
+            "name": res["snippet"].name,
+            "file_path": res["snippet"].file_path,
+            "start_line": res["snippet"].start_line + 1,
+            "content": res["snippet"].content,
+            "summary": res["snippet"].summary,
+            "relations": res.get("relations", [])
+        }
+        for res in results
+    ]
+
 def create_app(indexer: ProjectIndexer):
     app = Flask(__name__)
     CORS(app)
@@ -36,7 +81,7 @@ def create_app(indexer: ProjectIndexer):
         
         logger.info(f"Web Search Query: {query}")
         
-        if search_manager.chroma.collection.count() == 0:
+        if not search_manager.is_indexed():
             return jsonify({
                 "error": "Codebase not indexed",
                 "needs_indexing": True
@@ -50,22 +95,10 @@ def create_app(indexer: ProjectIndexer):
                 return jsonify({"answer": "No relevant code found.", "snippets": []})
 
             answer = search_manager.answer_query(query, results)
-            
-            formatted_snippets = []
-            for res in results:
-                s = res["snippet"]
-                formatted_snippets.append({
-                    "name": s.name,
-                    "file_path": s.file_path,
-                    "start_line": s.start_line + 1,
-                    "content": s.content,
-                    "summary": s.summary,
-                    "relations": res.get("relations", [])
-                })
                 
             return jsonify({
                 "answer": answer,
-                "snippets": formatted_snippets,
+                "snippets": _format_snippets(results),
                 "hyde_used": search_data["hyde_used"],
                 "final_query": search_data["final_query"]
             })
@@ -80,46 +113,35 @@ def create_app(indexer: ProjectIndexer):
         if not query:
             return jsonify({"error": "No query provided"}), 400
         
-        try:
-            search_data = search_manager.search(query, 10)
-            results = search_data["results"]
-            
-            if not results:
-                return jsonify({"answer": "No relevant code found.", "snippets": []})
+        def generate():
+            # Sent before the search starts, so the client gets its first byte right away
+            yield _sse({"type": "status", "message": "retrieving"})
 
-            formatted_snippets = []
-            for res in results:
-                s = res["snippet"]
-                formatted_snippets.append({
-                    "name": s.name,
-                    "file_path": s.file_path,
-                    "start_line": s.start_line + 1,
-                    "content": s.content,
-                    "summary": s.summary,
-                    "relations": res.get("relations", [])
-                })
-
-            def generate():
-                # First, send metadata and snippets
+            try:
+                search_data = search_manager.search(query, 10)
+                results = search_data["results"]
+
+                # Then, send metadata and snippets
                 initial_payload = {
                     "type": "metadata",
-                    "snippets": formatted_snippets,
+                    "snippets": _format_snippets(results),
                     "hyde_used": search_data["hyde_used"],
                     "final_query": search_data["final_query"]
                 }
-                yield f"data: {json.dumps(initial_payload)}\n\n"
-
-                for token in search_manager.stream_answer_query(query, results):
-                    payload = {"type": "token", "token": token}
-                    yield f"data: {json.dumps(payload)}\n\n"
-                
-                yield "data: [DONE]\n\n"
-
-            return Response(stream_with_context(generate()), content_type='text/event-stream')
+                yield _sse(initial_payload)
+
+                if not results:
+                    yield _sse({"type": "token", "token": "No relevant code found."})
+                else:
+                    for tokens in _coalesce_tokens(search_manager.stream_answer_query(query, results)):
+                        yield _TOKENS_FRAME_HEAD + orjson.dumps(tokens) + _TOKENS_FRAME_TAIL
+            except Exception as e:
+                logger.error(f"Streaming search error: {e}")
+                yield _sse({"type": "error", "error": str(e)})
             
-        except Exception as e:
-            logger.error(f"Streaming search error: {e}")
-            return jsonify({"error": str(e)}), 500
+            yield _DONE_FRAME
+
+        return Response(stream_with_context(generate()), content_type='text/event-stream')
 
     @app.route('/api/reindex', methods=['POST'])
     def reindex():
@@ -127,11 +149,12 @@ def create_app(indexer: ProjectIndexer):
             logger.info("Web Reindex Request started...")
             indexer.initialize_storage()
             snippets = indexer.extract_snippets()
-            relationships = indexer.extract_relationships(snippets)
+            relationships_future = indexer.extract_relationships_async(snippets)
             indexer.summarize_snippets(snippets)
             embeddings = indexer.embed_snippets(snippets)
-            indexer.save(snippets, relationships, embeddings=embeddings)
+            indexer.save(snippets, relationships_future.result(), embeddings=embeddings)
             indexer.cleanup(snippets)
+            search_manager.on_index_updated()
             logger.info("Web Reindex Request completed successfully.")
             return jsonify({"status": "success", "message": f"Indexed {len(snippets)} snippets"})
         except Exception as e:
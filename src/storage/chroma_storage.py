@@ -1,21 +1,58 @@
 import os
 import logging
 import chromadb
-from typing import List, Optional, Dict, Any
+import numpy as np
+from typing import List, Optional, Dict, Any, NamedTuple
 from src.IR.models import CodeSnippet
 
 logger = logging.getLogger(__name__)
 
+# HNSW build parameters, fixed once a collection exists: more links per node and a wider build
+# beam than Chroma's defaults (16 / 100) keep recall high for the ~100 candidates search asks for
+HNSW_BUILD_SETTINGS = {"max_neighbors": 32, "ef_construction": 200}
+# Candidate list size at query time; it must stay above the largest n_results requested
+HNSW_SEARCH_EF = 128
+
+
+class VectorHits(NamedTuple):
+    """Columnar query results, aligned by position and ordered by distance."""
+    ids: List[str]
+    documents: List[str]
+    metadatas: List[Dict[str, Any]]
+    distances: np.ndarray
+
+
 class ChromaStorage:
     def __init__(self, path: str = "data/chroma", collection_name: str = "codebase"):
         os.makedirs(path, exist_ok=True)
         self.client = chromadb.PersistentClient(path=path)
         self.collection = self.client.get_or_create_collection(
             name=collection_name,
-            metadata={"hnsw:space": "cosine"}
+            configuration={"hnsw": {"space": "cosine", "ef_search": HNSW_SEARCH_EF, **HNSW_BUILD_SETTINGS}}
         )
+        self._check_index_settings(path)
         logger.info(f"ChromaDB initialized at {path}, collection: {collection_name} (cosine similarity)")
 
+    def _check_index_settings(self, path: str):
+        """
+        Brings ef_search of an existing collection up to date. Build parameters cannot change without
+        re-embedding everything, so a collection built with others is only reported.
+        """
+        configuration = self.collection.configuration or {}
+        current = configuration.get("hnsw") or {}
+        if current.get("ef_search") != HNSW_SEARCH_EF:
+            try:
+                self.collection.modify(configuration={"hnsw": {"ef_search": HNSW_SEARCH_EF}})
+            except Exception as e:
+                logger.warning(f"Could not update ef_search of collection {self.collection.name}: {e}")
+
+        built = {key: current.get(key) for key in HNSW_BUILD_SETTINGS}
+        if built != HNSW_BUILD_SETTINGS:
+            logger.info(
+                f"Collection {self.collection.name} was built with HNSW parameters {built} instead of {HNSW_BUILD_SETTINGS}; "
+                f"delete {path} and reindex to rebuild it"
+            )
+
     def save_snippets(self, snippets: List[CodeSnippet], embeddings: List[Any]):
         """
         Saves snippets and their embeddings to ChromaDB.
@@ -27,9 +64,8 @@ class ChromaStorage:
             raise ValueError("Number of snippets and embeddings must match")
 
         ids = [s.id for s in snippets]
-        metadatas = []
-        for s in snippets:
-            meta = {
+        metadatas = [
+            {
                 "name": s.name,
                 "type": s.type.value,
                 "file_path": s.file_path or "",
@@ -37,16 +73,22 @@ class ChromaStorage:
                 "end_line": s.end_line if s.end_line is not None else -1,
                 "is_skeleton": s.is_skeleton
             }
-            metadatas.append(meta)
+            for s in snippets
+        ]
         
-        documents = [s.to_embeddable_text(use_summary=True) for s in snippets]
+        # Memoized on each snippet, normally already built when the snippets were embedded with summaries
+        documents = [s.embeddable_text for s in snippets]
+
+        # HNSW stores float32 regardless, so vectors are upserted at full precision.
+        # Stacked once so each batch converts with a single tolist() instead of one call per vector
+        embeddings = np.asarray(embeddings, dtype=np.float32)
 
         batch_size = 500
         for i in range(0, len(snippets), batch_size):
             end = min(i + batch_size, len(snippets))
             self.collection.upsert(
                 ids=ids[i:end],
-                embeddings=[e.tolist() if hasattr(e, "tolist") else e for e in embeddings[i:end]],
+                embeddings=embeddings[i:end].tolist(),
                 metadatas=metadatas[i:end],
                 documents=documents[i:end]
             )
@@ -60,35 +102,32 @@ class ChromaStorage:
         self.collection.delete(where={"file_path": file_path})
         logger.debug(f"Deleted snippets for file {file_path} from ChromaDB")
 
-    def query(self, query_embedding: Any, n_results: int = 5) -> List[Dict[str, Any]]:
+    def delete_files_bulk(self, file_paths: List[str]):
+        """
+        Deletes all snippets of many files with a single filtered delete.
+        """
+        if not file_paths:
+            return
+        self.collection.delete(where={"file_path": {"$in": list(file_paths)}})
+        logger.debug(f"Deleted snippets for {len(file_paths)} files from ChromaDB")
+
+    def query(self, query_embedding: Any, n_results: int = 5) -> VectorHits:
         """
         Searches for snippets similar to the query embedding.
+        Results keep Chroma's columnar layout instead of being unpacked into one dict per hit.
         """
         results = self.collection.query(
-            query_embeddings=[query_embedding.tolist() if hasattr(query_embedding, "tolist") else query_embedding],
+            query_embeddings=np.atleast_2d(np.asarray(query_embedding, dtype=np.float32)),
             n_results=n_results
         )
-        
-        parsed_results = []
-        if results["ids"]:
-            for i in range(len(results["ids"][0])):
-                parsed_results.append({
-                    "id": results["ids"][0][i],
-                    "metadata": results["metadatas"][0][i],
-                    "document": results["documents"][0][i],
-                    "distance": results["distances"][0][i]
-                })
-        
-        return parsed_results
 
-    def get_all_file_paths(self) -> List[str]:
-        """
-        Retrieves all unique file paths stored in ChromaDB.
-        """
-        results = self.collection.get(include=["metadatas"])
-        if not results["metadatas"]:
-            return []
-        
-        file_paths = {m.get("file_path") for m in results["metadatas"] if m.get("file_path")}
-        return list(file_paths)
+        if not results.get("ids") or not results["ids"][0]:
+            return VectorHits([], [], [], np.empty(0, dtype=np.float32))
+
+        return VectorHits(
+            ids=results["ids"][0],
+            documents=results["documents"][0],
+            metadatas=results["metadatas"][0],
+            distances=np.asarray(results["distances"][0], dtype=np.float32)
+        )
 
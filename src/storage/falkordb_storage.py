@@ -1,119 +1,185 @@
 import logging
 import os
-from typing import List
+from functools import lru_cache
+from typing import Iterator, List, Dict
 from redislite import FalkorDB
 from src.IR.models import CodeSnippet, SnippetType, Relationship, GraphNode
 
 logger = logging.getLogger(__name__)
 
+# Default rows sent per UNWIND query when writing nodes and edges
+GRAPH_BATCH_SIZE = 1000
+# Stored type value -> member, a plain dict lookup per node instead of the Enum call machinery
+_SNIPPET_TYPES = {m.value: m for m in SnippetType}
+
+# FalkorDB caches execution plans by query text, so every query is a fixed, parameterized string
+_Q_LIST_INDEXES = "CALL db.indexes() YIELD label, properties"
+# (label, property) -> query creating its range index
+_INDEX_QUERIES = {
+    ("Snippet", "id"): "CREATE INDEX FOR (s:Snippet) ON (s.id)",
+    # Incremental indexing deletes nodes file by file
+    ("Snippet", "file_path"): "CREATE INDEX FOR (s:Snippet) ON (s.file_path)",
+}
+_Q_SAVE_SNIPPETS = """
+UNWIND $rows AS r
+MERGE (s:Snippet {id: r.id})
+SET s.name = r.name, 
+    s.type = r.type, 
+    s.file_path = r.file_path
+"""
+_Q_FILE_PATHS = "MATCH (s:Snippet) WHERE s.file_path <> '' RETURN DISTINCT s.file_path"
+_Q_DELETE_FILE = "MATCH (s:Snippet {file_path: $path}) DETACH DELETE s"
+_Q_DELETE_FILES = "MATCH (s:Snippet) WHERE s.file_path IN $paths DETACH DELETE s"
+_Q_GET_RELS = """
+MATCH (s:Snippet {id: $id})-[r]->(t:Snippet)
+RETURN type(r) AS rel_type, t.name AS target_name
+"""
+# UNWIND + inline id lets each lookup seek the Snippet.id index instead of filtering a label scan
+_Q_GET_RELS_BULK = """
+UNWIND $ids AS id
+MATCH (s:Snippet {id: id})-[r]->(t:Snippet)
+RETURN id AS source_id, type(r) AS rel_type, t.name AS target_name
+"""
+_Q_ALL_NODES = """
+MATCH (s:Snippet) 
+RETURN s.id AS id, s.name AS name, s.type AS type, s.file_path AS file_path
+"""
+
+@lru_cache(maxsize=None)
+def _save_relationships_query(rel_type: str) -> str:
+    """
+    Relationship types cannot be parameterized, so each type gets one fixed query string.
+    Targets that are not indexed (external symbols) are created as placeholders in the same pass.
+    """
+    return f"""
+UNWIND $pairs AS p
+MATCH (src:Snippet {{id: p.src}})
+MERGE (dst:Snippet {{id: p.dst}})
+ON CREATE SET dst.name = p.dst, dst.type = 'placeholder', dst.file_path = ''
+MERGE (src)-[:{rel_type}]->(dst)
+"""
+
+def _chunks(rows: List, size: int) -> Iterator[List]:
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
 class FalkorDBStorage:
-    def __init__(self, db_path: str = "data/graph.db", graph_name: str = "codebase"):
+    def __init__(self, db_path: str = "data/graph.db", graph_name: str = "codebase", batch_size: int = GRAPH_BATCH_SIZE):
+        """batch_size bounds the rows per UNWIND query, and so the memory each write query takes on the server."""
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.batch_size = batch_size
         self.db = FalkorDB(db_path)
         self.graph = self.db.select_graph(graph_name)
         self._init_indices()
 
     def _init_indices(self):
-        """Creates indices for Snippets."""
+        """Creates the Snippet indices that do not exist yet, so warm starts skip the failing CREATEs."""
         try:
-            self.graph.query("CREATE INDEX FOR (s:Snippet) ON (s.id)")
+            result = self.graph.query(_Q_LIST_INDEXES)
+            existing = {(label, prop) for label, properties in result.result_set for prop in properties}
         except Exception as e:
-            logger.debug(f"Index creation note: {e}")
+            # A graph that was never written to has no indices to list
+            logger.debug(f"Could not list FalkorDB indices: {e}")
+            existing = set()
+
+        for key, query in _INDEX_QUERIES.items():
+            if key in existing:
+                continue
+            try:
+                self.graph.query(query)
+            except Exception as e:
+                logger.debug(f"Index creation note: {e}")
 
     def save_snippets(self, snippets: List[CodeSnippet]):
         if not snippets:
             return
 
-        for s in snippets:
-            query = """
-            MERGE (s:Snippet {id: $id})
-            SET s.name = $name, 
-                s.type = $type, 
-                s.file_path = $file_path
-            """
-            params = {
-                "id": s.id,
-                "name": s.name,
-                "type": s.type.value,
-                "file_path": s.file_path or ""
-            }
+        # Keyed by id so duplicates cost no MERGE probes; the last occurrence wins, as it would in the graph
+        rows = list({
+            s.id: {"id": s.id, "name": s.name, "type": s.type.value, "file_path": s.file_path or ""}
+            for s in snippets
+        }.values())
+        for n, batch in enumerate(_chunks(rows, self.batch_size)):
             try:
-                self.graph.query(query, params)
+                self.graph.query(_Q_SAVE_SNIPPETS, {"rows": batch})
             except Exception as e:
-                logger.error(f"Error saving snippet {s.id} to FalkorDB: {e}")
+                logger.error(f"Error saving snippet batch {n} to FalkorDB: {e}")
 
     def save_relationships(self, relationships: List[Relationship]):
         if not relationships:
             return
 
-        target_ids = list(set(r.target_id for r in relationships))
-        for target_id in target_ids:
-            placeholder_query = """
-            MERGE (s:Snippet {id: $id})
-            ON CREATE SET s.name = $id, s.type = 'placeholder', s.file_path = ''
-            """
-            try:
-                self.graph.query(placeholder_query, {"id": target_id})
-            except Exception as e:
-                logger.error(f"Error ensuring FalkorDB placeholder {target_id}: {e}")
-
+        # Relationship types cannot be parameterized, so edges are written in one batch series per type.
+        # Repeated edges (e.g. several calls to the same function) are sent once.
+        edges_by_type: Dict[str, Dict[tuple, None]] = {}
         for r in relationships:
-            rel_type = r.type.value.upper()
-            rel_query = f"""
-            MATCH (src:Snippet {{id: $src}})
-            MATCH (dst:Snippet {{id: $dst}})
-            MERGE (src)-[:{rel_type}]->(dst)
-            """
-            params = {"src": r.source_id, "dst": r.target_id}
-            try:
-                self.graph.query(rel_query, params)
-            except Exception as e:
-                logger.error(f"Error saving FalkorDB relationship {rel_type}: {e}")
+            edges_by_type.setdefault(r.type.value.upper(), {})[(r.source_id, r.target_id)] = None
+
+        for rel_type, edges in edges_by_type.items():
+            rel_query = _save_relationships_query(rel_type)
+            pairs = [{"src": src, "dst": dst} for src, dst in edges]
+            for batch in _chunks(pairs, self.batch_size):
+                try:
+                    self.graph.query(rel_query, {"pairs": batch})
+                except Exception as e:
+                    logger.error(f"Error saving FalkorDB relationships {rel_type}: {e}")
 
     def get_all_file_paths(self) -> List[str]:
-        query = "MATCH (s:Snippet) WHERE s.file_path <> '' RETURN DISTINCT s.file_path"
         try:
-            result = self.graph.query(query)
+            result = self.graph.query(_Q_FILE_PATHS)
             return [record[0] for record in result.result_set]
         except Exception as e:
             logger.error(f"Error fetching file paths from FalkorDB: {e}")
             return []
 
     def delete_file_data(self, file_path: str):
-        query = "MATCH (s:Snippet {file_path: $path}) DETACH DELETE s"
         try:
-            self.graph.query(query, {"path": file_path})
+            self.graph.query(_Q_DELETE_FILE, {"path": file_path})
         except Exception as e:
             logger.error(f"Error deleting FalkorDB data for file {file_path}: {e}")
 
+    def delete_files_bulk(self, file_paths: List[str]):
+        """Deletes the nodes of many files with a single query."""
+        if not file_paths:
+            return
+        try:
+            self.graph.query(_Q_DELETE_FILES, {"paths": list(file_paths)})
+        except Exception as e:
+            logger.error(f"Error deleting FalkorDB data for {len(file_paths)} files: {e}")
+
     def get_snippet_relationships(self, snippet_id: str) -> List[tuple]:
         """Returns all outgoing relationships for a snippet as (rel_type, target_name)"""
-        query = """
-        MATCH (s:Snippet {id: $id})-[r]->(t:Snippet)
-        RETURN type(r) AS rel_type, t.name AS target_name
-        """
         relationships = []
         try:
-            result = self.graph.query(query, {"id": snippet_id})
+            result = self.graph.query(_Q_GET_RELS, {"id": snippet_id})
             for record in result.result_set:
                 relationships.append((record[0].lower(), record[1]))
         except Exception as e:
             logger.error(f"Error fetching FalkorDB relationships for {snippet_id}: {e}")
         return relationships
 
+    def get_relationships_for(self, snippet_ids: List[str]) -> Dict[str, List[tuple]]:
+        """Returns the outgoing relationships of many snippets in a single query, keyed by snippet id"""
+        relationships: Dict[str, List[tuple]] = {sid: [] for sid in snippet_ids}
+        if not snippet_ids:
+            return relationships
+        try:
+            result = self.graph.query(_Q_GET_RELS_BULK, {"ids": list(snippet_ids)})
+            for record in result.result_set:
+                relationships[record[0]].append((record[1].lower(), record[2]))
+        except Exception as e:
+            logger.error(f"Error fetching FalkorDB relationships for {len(snippet_ids)} snippets: {e}")
+        return relationships
+
     def get_all_nodes(self) -> List[GraphNode]:
-        query = """
-        MATCH (s:Snippet) 
-        RETURN s.id AS id, s.name AS name, s.type AS type, s.file_path AS file_path
-        """
         nodes = []
         try:
-            result = self.graph.query(query)
+            result = self.graph.query(_Q_ALL_NODES)
             for record in result.result_set:
                 nodes.append(GraphNode(
                     id=record[0],
                     name=record[1],
-                    type=SnippetType(record[2]),
+                    type=_SNIPPET_TYPES[record[2]],
                     file_path=record[3] if record[3] else None
                 ))
         except Exception as e:
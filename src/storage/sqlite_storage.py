@@ -1,34 +1,201 @@
 import os
 import sqlite3
-import json
 import logging
+import queue
 import re
-from typing import List, Optional, Dict
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator, List, Optional, Dict
+
+import numpy as np
+import orjson
 
 from src.IR.models import CodeSnippet, SnippetType
 
 logger = logging.getLogger(__name__)
 
+# Idle read connections kept open, one per concurrent search worker
+READ_POOL_SIZE = 8
+# Per-connection settings; WAL lets these readers run in parallel with each other and with a writer
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=30000000000",
+    "PRAGMA cache_size=-65536",  # Upper bound of 64 MiB, only filled as pages are read
+    # INSERT OR REPLACE only fires the delete triggers that keep the FTS indexes in sync with this on
+    "PRAGMA recursive_triggers=ON",
+)
+# Prepared statements kept per connection (sqlite3 defaults to 128)
+CACHED_STATEMENTS = 256
+# Rows fetched at a time when streaming large result sets
+FETCH_BATCH = 1024
+# Rows at or above which saving into an empty database skips the FTS triggers and indexes in one bulk pass
+BULK_LOAD_ROWS = 5000
+# Triggers keeping the FTS indexes in sync, dropped for the duration of a bulk load
+_FTS_TRIGGERS = ("snippets_ai", "snippets_ad", "snippets_au", "snippets_trigram_ai", "snippets_trigram_ad", "snippets_trigram_au")
+# Shortest substring the trigram index can match; shorter ones still need a LIKE scan
+TRIGRAM_MIN_CHARS = 3
+# Porter stemming over unicode61 lets "parse" match "parser"/"parsing" in the keyword index
+FTS_TOKENIZER = "porter unicode61"
+# Distinct query strings whose FTS expressions are kept (search-as-you-type repeats them)
+FTS_STRATEGY_CACHE_SIZE = 256
+# Stored type value -> member, a plain dict lookup per row instead of the Enum call machinery
+_SNIPPET_TYPES = {m.value: m for m in SnippetType}
+# Identifier-like search terms, dotted names included
+_TERM_RE = re.compile(r"[a-zA-Z0-9_.]+")
+
+# Hot statements as fixed strings. Lists are bound as one JSON array rather than one placeholder per
+# item, so the text never varies with the list length and the statement cache prepares each one once.
+_SQL_SNIPPETS_BY_ID = "SELECT * FROM snippets WHERE id IN (SELECT value FROM json_each(?))"
+_SQL_SNIPPETS_BY_ROWID = "SELECT *, rowid AS row_key FROM snippets WHERE rowid IN (SELECT value FROM json_each(?))"
+_SQL_ROWIDS_BY_NAME = "SELECT rowid FROM snippets WHERE name IN (SELECT value FROM json_each(?)) LIMIT ?"
+# Ranked (bm25 via `rank`) and limited inside FTS5, without touching the snippets table
+_SQL_FTS_ROWIDS = "SELECT rowid FROM snippets_fts WHERE snippets_fts MATCH ? ORDER BY rank LIMIT ?"
+# The trigram index only produces rowids; rows are then read by rowid, without a join
+_SQL_SNIPPETS_BY_NAME_LIKE = "SELECT * FROM snippets WHERE rowid IN (SELECT rowid FROM snippets_trigram WHERE name LIKE ?)"
+_SQL_TRIGRAM_ROWIDS = "SELECT rowid FROM snippets_trigram WHERE snippets_trigram MATCH ? LIMIT ?"
+_SQL_UPSERT_SNIPPET = """
+    INSERT INTO snippets (
+        id, name, type, content, summary, parent_id, docstring, signature, 
+        file_path, start_line, end_line, start_byte, end_byte, is_skeleton, metadata_json
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        name = excluded.name, type = excluded.type, content = excluded.content,
+        summary = excluded.summary, parent_id = excluded.parent_id, docstring = excluded.docstring,
+        signature = excluded.signature, file_path = excluded.file_path,
+        start_line = excluded.start_line, end_line = excluded.end_line,
+        start_byte = excluded.start_byte, end_byte = excluded.end_byte,
+        is_skeleton = excluded.is_skeleton, metadata_json = excluded.metadata_json
+"""
+# Removes the rows of a re-parsed file whose ids are not in its new snippet set
+_SQL_DELETE_STALE = "DELETE FROM snippets WHERE file_path = ? AND id NOT IN (SELECT value FROM json_each(?))"
+_SQL_UPSERT_FILE_HASH = "INSERT OR REPLACE INTO file_hashes (file_path, content_hash) VALUES (?, ?)"
+
+def _as_text(value) -> Optional[str]:
+    """Stores strings as-is and structured values (e.g. a summary dict) as JSON."""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return orjson.dumps(value).decode()
+    return str(value)
+
+def _snippet_row(s: CodeSnippet) -> tuple:
+    """Column values of a snippet, in _SQL_UPSERT_SNIPPET order."""
+    return (
+        s.id, s.name, s.type.value, s.content, _as_text(s.summary), _as_text(s.parent_id),
+        s.docstring, s.signature, s.file_path, s.start_line, s.end_line,
+        s.start_byte, s.end_byte, 1 if s.is_skeleton else 0,
+        # Bound as bytes, so stored as a BLOB that orjson parses without a str round trip
+        orjson.dumps(s.metadata) if s.metadata else None
+    )
+
+def _fts_quote(text: str) -> str:
+    """Quotes text as an FTS5 string literal."""
+    return '"' + text.replace('"', '""') + '"'
+
+@lru_cache(maxsize=FTS_STRATEGY_CACHE_SIZE)
+def _build_fts_strategies(query: str):
+    """
+    Returns ({stage: FTS expression}, identifier terms) for a query, or None if it has no terms.
+    Terms are quoted as FTS5 strings, so dotted names like os.path are not parsed as syntax.
+    The result is cached and shared, so callers must not modify it.
+    """
+    original_terms = _TERM_RE.findall(query)
+    if not original_terms:
+        return None
+
+    tech_terms = tuple(t for t in original_terms if len(t) > 1)
+    strategies = {}
+    if len(tech_terms) > 1:
+        quoted = [_fts_quote(t) for t in tech_terms]
+        strategies["phrase"] = _fts_quote(" ".join(tech_terms)) # Exact phrase
+        strategies["and"] = " AND ".join(quoted)
+        strategies["or"] = " OR ".join(quoted)
+    else:
+        # A single term matches the same rows under AND and OR, so it runs as one stage
+        strategies["or"] = " OR ".join(_fts_quote(t) for t in (tech_terms or original_terms))
+    return strategies, tech_terms
+
 class SQLiteStorage:
     def __init__(self, db_path: str = "data/codebase.db"):
         self.db_path = db_path
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._read_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        # Writes share one long-lived connection, opened on first use; SQLite allows a single writer anyway
+        self._write_conn: Optional[sqlite3.Connection] = None
+        self._write_lock = threading.Lock()
         self._init_db()
 
-    def _get_connection(self) -> sqlite3.Connection:
-        """Helper to get a configured connection."""
-        conn = sqlite3.connect(self.db_path)
+    def _get_connection(self, read_only: bool = False) -> sqlite3.Connection:
+        """Helper to get a configured connection. Read-only ones can never take the write lock."""
+        database, uri = self.db_path, False
+        if read_only:
+            database, uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro", True
+        # Pooled connections are handed between worker threads, but only ever used by one at a time
+        conn = sqlite3.connect(database, uri=uri, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
         conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
         return conn
 
+    @contextmanager
+    def _read_connection(self) -> Iterator[sqlite3.Connection]:
+        """Borrows a connection from the read pool, opening a new one when all are in use."""
+        try:
+            conn = self._read_pool.get_nowait()
+        except queue.Empty:
+            conn = self._get_connection(read_only=True)
+        try:
+            yield conn
+        finally:
+            if self._read_pool.qsize() < READ_POOL_SIZE:
+                self._read_pool.put(conn)
+            else:
+                conn.close()
+
+    @contextmanager
+    def _write_connection(self) -> Iterator[sqlite3.Connection]:
+        """Holds the shared write connection for one transaction, rolling it back if it fails."""
+        with self._write_lock:
+            if self._write_conn is None:
+                self._write_conn = self._get_connection()
+            try:
+                yield self._write_conn
+            except BaseException:
+                self._write_conn.rollback()
+                raise
+
+    def close(self):
+        """Closes the write connection and every pooled read connection."""
+        with self._write_lock:
+            if self._write_conn is not None:
+                # Analyzes whatever the queries run on this connection would benefit from
+                self._write_conn.execute("PRAGMA optimize")
+                self._write_conn.close()
+                self._write_conn = None
+        while True:
+            try:
+                self._read_pool.get_nowait().close()
+            except queue.Empty:
+                break
+
     def _init_db(self):
         """Initialize the database schema, FTS, and triggers."""
-        with self._get_connection() as conn:
+        with self._write_connection() as conn:
+            # Persistent on the database file, so it only has to be set here
+            conn.execute("PRAGMA journal_mode=WAL")
             cursor = conn.cursor()
             self._create_tables(cursor)
             self._setup_fts(cursor)
             self._create_triggers(cursor)
+            self._setup_trigram_index(cursor)
             conn.commit()
+            # Refreshes planner statistics for tables whose stats are missing or stale (SQLite 3.46+),
+            # sampling at most ~400 rows per index so startup stays fast on large databases
+            conn.execute("PRAGMA analysis_limit=400")
+            conn.execute("PRAGMA optimize=0x10002")
 
     def _create_tables(self, cursor: sqlite3.Cursor):
         cursor.execute("""
@@ -47,7 +214,7 @@ class SQLiteStorage:
                 start_byte INTEGER,
                 end_byte INTEGER,
                 is_skeleton INTEGER DEFAULT 0,
-                metadata_json TEXT
+                metadata_json BLOB
             )
         """)
         cursor.execute("""
@@ -56,32 +223,36 @@ class SQLiteStorage:
                 content_hash TEXT
             )
         """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                hash TEXT,
+                model TEXT,
+                vector BLOB,
+                PRIMARY KEY (hash, model)
+            )
+        """)
+        # The identifier stage of search_by_content looks snippets up by exact name
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_snippets_name ON snippets(name)")
+        # Incremental indexing reads and deletes snippets file by file
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_snippets_file_path ON snippets(file_path)")
 
     def _setup_fts(self, cursor: sqlite3.Cursor):
         try:
-            cursor.execute("PRAGMA integrity_check")
-            if cursor.fetchone()[0] != "ok":
-                logger.warning("Database corruption detected during integrity check!")
-
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='snippets_fts'")
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='snippets_fts'")
             fts_exists = cursor.fetchone()
+            if fts_exists and FTS_TOKENIZER not in fts_exists[0]:
+                logger.info(f"Recreating FTS index with the '{FTS_TOKENIZER}' tokenizer...")
+                cursor.execute("DROP TABLE snippets_fts")
+                fts_exists = None
 
-            cursor.execute("""
+            cursor.execute(f"""
                 CREATE VIRTUAL TABLE IF NOT EXISTS snippets_fts 
-                USING fts5(id UNINDEXED, name, content, summary, content='snippets', content_rowid='rowid')
+                USING fts5(id UNINDEXED, name, content, summary, content='snippets', content_rowid='rowid', tokenize='{FTS_TOKENIZER}')
             """)
 
+            # The triggers keep an existing index in sync; check_integrity verifies it on demand
             if not fts_exists:
                 cursor.execute("INSERT INTO snippets_fts(snippets_fts) VALUES('rebuild')")
-            else:
-                cursor.execute("SELECT COUNT(*) FROM snippets")
-                s_count = cursor.fetchone()[0]
-                cursor.execute("SELECT COUNT(*) FROM snippets_fts")
-                f_count = cursor.fetchone()[0]
-                
-                if s_count != f_count:
-                    logger.warning(f"FTS index out of sync (snippets: {s_count}, FTS: {f_count}). Rebuilding...")
-                    cursor.execute("INSERT INTO snippets_fts(snippets_fts) VALUES('rebuild')")
 
         except sqlite3.OperationalError as e:
             if "malformed" in str(e).lower():
@@ -94,7 +265,10 @@ class SQLiteStorage:
                 logger.warning(f"FTS5 initialization failed: {e}. Falling back to LIKE.")
 
     def _create_triggers(self, cursor: sqlite3.Cursor):
-        """Ensure FTS index stays updated automatically."""
+        """
+        Ensure FTS index stays updated automatically. Updates only re-tokenize rows whose indexed
+        columns changed, so re-saving an unchanged snippet (an upsert, not a replace) costs no FTS work.
+        """
         triggers = [
             ("snippets_ai", """
                 CREATE TRIGGER snippets_ai AFTER INSERT ON snippets BEGIN
@@ -109,7 +283,9 @@ class SQLiteStorage:
                 END;
             """),
             ("snippets_au", """
-                CREATE TRIGGER snippets_au AFTER UPDATE ON snippets BEGIN
+                CREATE TRIGGER snippets_au AFTER UPDATE ON snippets
+                WHEN old.name IS NOT new.name OR old.content IS NOT new.content OR old.summary IS NOT new.summary
+                BEGIN
                   INSERT INTO snippets_fts(snippets_fts, rowid, id, name, content, summary) 
                   VALUES('delete', old.rowid, old.id, old.name, old.content, old.summary);
                   INSERT INTO snippets_fts(rowid, id, name, content, summary) 
@@ -122,24 +298,97 @@ class SQLiteStorage:
             cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
             cursor.execute(sql)
 
-    def _row_to_snippet(self, row: sqlite3.Row) -> CodeSnippet:
-        """Centralized converter from DB row to CodeSnippet object."""
+    def _setup_trigram_index(self, cursor: sqlite3.Cursor) -> bool:
+        """
+        Trigram index over snippet names, content and summaries, which lets FTS5 answer substring
+        searches (search_by_name's LIKE and search_by_content's last stage) without a table scan.
+        Returns whether the index is available.
+        """
+        # Replaced by this index, which also covers the name column it held
+        for name in ("snippet_names_ai", "snippet_names_ad", "snippet_names_au"):
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute("DROP TABLE IF EXISTS snippet_names_fts")
+
+        try:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='snippets_trigram'")
+            exists = cursor.fetchone()
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS snippets_trigram
+                USING fts5(name, content, summary, content='snippets', content_rowid='rowid', tokenize='trigram')
+            """)
+            if not exists:
+                cursor.execute("INSERT INTO snippets_trigram(snippets_trigram) VALUES('rebuild')")
+        except sqlite3.OperationalError as e:
+            # The trigram tokenizer needs SQLite 3.34+
+            logger.warning(f"Trigram index unavailable: {e}. Substring searches fall back to LIKE.")
+            return False
+
+        triggers = [
+            ("snippets_trigram_ai", """
+                CREATE TRIGGER snippets_trigram_ai AFTER INSERT ON snippets BEGIN
+                  INSERT INTO snippets_trigram(rowid, name, content, summary) VALUES (new.rowid, new.name, new.content, new.summary);
+                END;
+            """),
+            ("snippets_trigram_ad", """
+                CREATE TRIGGER snippets_trigram_ad AFTER DELETE ON snippets BEGIN
+                  INSERT INTO snippets_trigram(snippets_trigram, rowid, name, content, summary)
+                  VALUES('delete', old.rowid, old.name, old.content, old.summary);
+                END;
+            """),
+            ("snippets_trigram_au", """
+                CREATE TRIGGER snippets_trigram_au AFTER UPDATE ON snippets
+                WHEN old.name IS NOT new.name OR old.content IS NOT new.content OR old.summary IS NOT new.summary
+                BEGIN
+                  INSERT INTO snippets_trigram(snippets_trigram, rowid, name, content, summary)
+                  VALUES('delete', old.rowid, old.name, old.content, old.summary);
+                  INSERT INTO snippets_trigram(rowid, name, content, summary) VALUES (new.rowid, new.name, new.content, new.summary);
+                END;
+            """)
+        ]
+
+        for name, sql in triggers:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+            cursor.execute(sql)
+        return True
+
+    @contextmanager
+    def _bulk_load(self, conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+        """
+        Runs the writes of one transaction with the FTS triggers dropped, then rebuilds the FTS indexes
+        in a single pass, which tokenizes far faster than row-by-row triggers. The rebuild covers the
+        whole table, so this only pays off when the transaction writes most of its rows.
+        """
+        conn.execute("PRAGMA synchronous=OFF")
+        try:
+            # Opened explicitly, since DDL would otherwise run (and commit) outside the transaction
+            conn.execute("BEGIN")
+            for name in _FTS_TRIGGERS:
+                conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+            yield conn
+            cursor = conn.cursor()
+            self._create_triggers(cursor)
+            cursor.execute("INSERT INTO snippets_fts(snippets_fts) VALUES('rebuild')")
+            if self._setup_trigram_index(cursor):
+                cursor.execute("INSERT INTO snippets_trigram(snippets_trigram) VALUES('rebuild')")
+            conn.commit()
+        finally:
+            # A failed load rolls back the dropped triggers along with the rows
+            conn.rollback()
+            conn.execute("PRAGMA synchronous=NORMAL")
+
+    @staticmethod
+    def _row_to_snippet(row) -> CodeSnippet:
+        """
+        Centralized converter from DB row to CodeSnippet object. Columns are unpacked by position
+        (SELECT * returns them in CREATE TABLE order), so bulk reads can use plain tuple rows.
+        """
+        (sid, name, type_, content, summary, parent_id, docstring, signature, file_path,
+         start_line, end_line, start_byte, end_byte, is_skeleton, metadata_json) = row
         return CodeSnippet(
-            id=row["id"],
-            name=row["name"],
-            type=SnippetType(row["type"]),
-            content=row["content"],
-            summary=row["summary"],
-            parent_id=row["parent_id"],
-            docstring=row["docstring"],
-            signature=row["signature"],
-            file_path=row["file_path"],
-            start_line=row["start_line"],
-            end_line=row["end_line"],
-            start_byte=row["start_byte"],
-            end_byte=row["end_byte"],
-            is_skeleton=bool(row["is_skeleton"]),
-            metadata=json.loads(row["metadata_json"]) if row["metadata_json"] else {}
+            sid, name, _SNIPPET_TYPES[type_], content, summary, parent_id, docstring, signature, file_path,
+            start_line, end_line, start_byte, end_byte, bool(is_skeleton),
+            # Older rows hold TEXT (empty metadata as '{}', which needs no parsing); orjson reads both kinds
+            orjson.loads(metadata_json) if metadata_json and metadata_json != "{}" else {}
         )
 
     def save_snippets(self, snippets: List[CodeSnippet], _retry_count: int = 0):
@@ -147,30 +396,9 @@ class SQLiteStorage:
             return
 
         try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                sql = """
-                    INSERT OR REPLACE INTO snippets (
-                        id, name, type, content, summary, parent_id, docstring, signature, 
-                        file_path, start_line, end_line, start_byte, end_byte, is_skeleton, metadata_json
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """
-                
-                batch_data = []
-                for s in snippets:
-                    summary = s.summary
-                    if summary is not None and not isinstance(summary, str):
-                        summary = json.dumps(summary) if isinstance(summary, (dict, list)) else str(summary)
-
-                    parent_id = str(s.parent_id) if s.parent_id is not None and not isinstance(s.parent_id, str) else s.parent_id
-
-                    batch_data.append((
-                        s.id, s.name, s.type.value, s.content, summary, parent_id,
-                        s.docstring, s.signature, s.file_path, s.start_line, s.end_line,
-                        s.start_byte, s.end_byte, 1 if s.is_skeleton else 0, json.dumps(s.metadata)
-                    ))
-                
-                cursor.executemany(sql, batch_data)
+            with self._write_connection() as conn:
+                # Rows are produced as executemany consumes them, without an intermediate list
+                conn.executemany(_SQL_UPSERT_SNIPPET, map(_snippet_row, snippets))
                 conn.commit()
 
         except sqlite3.OperationalError as e:
@@ -183,29 +411,85 @@ class SQLiteStorage:
                 raise
 
     def get_file_hash(self, file_path: str) -> Optional[str]:
-        with self._get_connection() as conn:
+        with self._read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT content_hash FROM file_hashes WHERE file_path = ?", (file_path,))
             row = cursor.fetchone()
             return row["content_hash"] if row else None
 
     def save_file_hash(self, file_path: str, content_hash: str):
-        with self._get_connection() as conn:
+        self.save_file_hashes({file_path: content_hash})
+
+    def save_file_hashes(self, hashes: Dict[str, str]):
+        """Saves the content hashes of many files in a single transaction."""
+        if not hashes:
+            return
+        with self._write_connection() as conn:
+            conn.executemany(_SQL_UPSERT_FILE_HASH, hashes.items())
+            conn.commit()
+
+    def replace_files(self, file_paths: List[str], snippets: List[CodeSnippet], hashes: Dict[str, str], _retry_count: int = 0):
+        """
+        Swaps in the snippets of re-parsed files and saves file hashes in a single transaction.
+        Only rows whose ids disappeared are deleted; the rest are upserted, so unchanged snippets
+        (e.g. those above an edit) keep their FTS entries instead of being deleted and re-tokenized.
+        """
+        kept_ids: Dict[str, List[str]] = {path: [] for path in file_paths}
+        for s in snippets:
+            kept_ids.setdefault(s.file_path, []).append(s.id)
+
+        try:
+            with self._write_connection() as conn:
+                if len(snippets) >= BULK_LOAD_ROWS and conn.execute("SELECT 1 FROM snippets LIMIT 1").fetchone() is None:
+                    logger.info(f"Bulk loading {len(snippets)} snippets into the empty index...")
+                    with self._bulk_load(conn):
+                        self._write_files(conn, kept_ids, snippets, hashes)
+                else:
+                    self._write_files(conn, kept_ids, snippets, hashes)
+                    conn.commit()
+        except sqlite3.OperationalError as e:
+            if "malformed" in str(e).lower() and _retry_count < 1:
+                logger.error(f"Corruption detected during file replace: {e}. Attempting FTS rebuild and retry...")
+                self._rebuild_fts_index()
+                self.replace_files(file_paths, snippets, hashes, _retry_count + 1)
+            else:
+                raise
+
+    @staticmethod
+    def _write_files(conn: sqlite3.Connection, kept_ids: Dict[str, List[str]], snippets: List[CodeSnippet], hashes: Dict[str, str]):
+        conn.executemany(_SQL_DELETE_STALE, ((path, orjson.dumps(ids).decode()) for path, ids in kept_ids.items()))
+        conn.executemany(_SQL_UPSERT_SNIPPET, map(_snippet_row, snippets))
+        conn.executemany(_SQL_UPSERT_FILE_HASH, hashes.items())
+
+    def get_query_embedding(self, query_hash: str, model: str) -> Optional[np.ndarray]:
+        """Returns a persisted query embedding as float32, or None if it was never stored."""
+        with self._read_connection() as conn:
+            row = conn.execute(
+                "SELECT vector FROM embedding_cache WHERE hash = ? AND model = ?", (query_hash, model)
+            ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row["vector"], dtype=np.float16).astype(np.float32)
+
+    def save_query_embedding(self, query_hash: str, model: str, vector: np.ndarray):
+        """Persists a query embedding, stored as float16 to halve its size."""
+        with self._write_connection() as conn:
             conn.execute(
-                "INSERT OR REPLACE INTO file_hashes (file_path, content_hash) VALUES (?, ?)", 
-                (file_path, content_hash)
+                "INSERT OR REPLACE INTO embedding_cache (hash, model, vector) VALUES (?, ?, ?)",
+                (query_hash, model, np.asarray(vector, dtype=np.float16).tobytes())
             )
             conn.commit()
 
     def get_file_snippets(self, file_path: str) -> List[CodeSnippet]:
-        with self._get_connection() as conn:
+        with self._read_connection() as conn:
             cursor = conn.cursor()
+            cursor.row_factory = None
             cursor.execute("SELECT * FROM snippets WHERE file_path = ?", (file_path,))
-            return [self._row_to_snippet(row) for row in cursor.fetchall()]
+            return [self._row_to_snippet(row) for row in cursor]
 
     def delete_file_snippets(self, file_path: str, _retry_count: int = 0):
         try:
-            with self._get_connection() as conn:
+            with self._write_connection() as conn:
                 conn.execute("DELETE FROM snippets WHERE file_path = ?", (file_path,))
                 conn.execute("DELETE FROM file_hashes WHERE file_path = ?", (file_path,))
                 conn.commit()
@@ -217,37 +501,61 @@ class SQLiteStorage:
             else:
                 raise
 
+    def delete_files_bulk(self, file_paths: List[str], _retry_count: int = 0):
+        """Deletes the snippets and hashes of many files in a single transaction."""
+        if not file_paths:
+            return
+        params = [(p,) for p in file_paths]
+        try:
+            with self._write_connection() as conn:
+                conn.executemany("DELETE FROM snippets WHERE file_path = ?", params)
+                conn.executemany("DELETE FROM file_hashes WHERE file_path = ?", params)
+                conn.commit()
+        except sqlite3.OperationalError as e:
+            if "malformed" in str(e).lower() and _retry_count < 1:
+                logger.error(f"Corruption detected during delete: {e}. Attempting FTS rebuild...")
+                self._rebuild_fts_index()
+                self.delete_files_bulk(file_paths, _retry_count + 1)
+            else:
+                raise
+
     def get_all_file_paths(self) -> List[str]:
-        with self._get_connection() as conn:
+        with self._read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT DISTINCT file_path FROM snippets WHERE file_path IS NOT NULL")
             return [row[0] for row in cursor.fetchall()]
 
     def get_all_snippets(self) -> List[CodeSnippet]:
-        with self._get_connection() as conn:
+        return list(self.iter_all_snippets())
+
+    def iter_all_snippets(self) -> Iterator[CodeSnippet]:
+        """Yields every snippet, converting rows as they are fetched rather than holding them all first."""
+        with self._read_connection() as conn:
             cursor = conn.cursor()
+            # Plain tuples are cheaper to build than sqlite3.Row, and _row_to_snippet reads by position
+            cursor.row_factory = None
             cursor.execute("SELECT * FROM snippets")
-            return [self._row_to_snippet(row) for row in cursor.fetchall()]
+            while rows := cursor.fetchmany(FETCH_BATCH):
+                for row in rows:
+                    yield self._row_to_snippet(row)
 
     def get_snippet(self, snippet_id: str) -> Optional[CodeSnippet]:
-        with self._get_connection() as conn:
+        with self._read_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM snippets WHERE id = ?", (snippet_id,))
             row = cursor.fetchone()
             return self._row_to_snippet(row) if row else None
 
     def get_snippets(self, snippet_ids: List[str]) -> Dict[str, CodeSnippet]:
-        """Bulk fetch snippets by ID."""
+        """Bulk fetch snippets by ID in a single statement."""
         if not snippet_ids:
             return {}
         
-        placeholders = ",".join(["?"] * len(snippet_ids))
-        query = f"SELECT * FROM snippets WHERE id IN ({placeholders})"
-        
-        with self._get_connection() as conn:
+        with self._read_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute(query, snippet_ids)
-            return {row["id"]: self._row_to_snippet(row) for row in cursor.fetchall()}
+            cursor.row_factory = None
+            rows = cursor.execute(_SQL_SNIPPETS_BY_ID, (orjson.dumps(list(snippet_ids)).decode(),)).fetchall()
+        return {row[0]: self._row_to_snippet(row) for row in rows}
 
     def search_by_content(self, query: str, limit: int = 50) -> List[CodeSnippet]:
         """
@@ -256,74 +564,112 @@ class SQLiteStorage:
         2. FTS Exact Phrase
         3. FTS AND (all terms)
         4. FTS OR (any term)
-        5. Fallback: Standard LIKE
+        5. Fallback: substring match (trigram index, LIKE for queries under 3 characters)
+        """
+        return self.search_by_content_multi([query], limit=limit)
+
+    def search_by_content_multi(self, queries: List[str], limit: int = 50) -> List[CodeSnippet]:
         """
-        original_terms = re.findall(r'[a-zA-Z0-9_\.]+', query.strip())
-        if not original_terms:
+        Runs the search_by_content stages for several queries at once: each stage ORs the
+        per-query match expressions into a single statement, so FTS ranks all of them together.
+        """
+        stages = [_build_fts_strategies(q) for q in queries]
+        stages = [st for st in stages if st is not None]
+        if not stages:
             return []
 
-        tech_terms = [t for t in original_terms if len(t) > 1]
-        
-        results_map: Dict[str, sqlite3.Row] = {}
+        identifiers = list(dict.fromkeys(t for _, terms in stages for t in terms if len(t) >= 3))
+        # Stages only collect rowids, in result order; full rows are read once, for the final set
+        rowids: Dict[int, None] = {}
 
-        with self._get_connection() as conn:
+        with self._read_connection() as conn:
             cursor = conn.cursor()
 
-            for term in tech_terms:
-                if len(term) < 3:
-                    continue
-                # We use a fake rank of -100.0 to push these to the top if we were sorting later
-                cursor.execute("SELECT *, -100.0 as rank FROM snippets WHERE name = ? LIMIT ?", (term, limit))
-                for r in cursor.fetchall():
-                    results_map.setdefault(r["id"], r)
-
-            fts_strategies = []
-            if len(tech_terms) > 1:
-                fts_strategies.append(f'"{ " ".join(tech_terms) }"') # Exact phrase
-            
-            if tech_terms:
-                fts_strategies.append(" AND ".join(tech_terms))
-                fts_strategies.append(" OR ".join(tech_terms))
-            else:
-                fts_strategies.append(" OR ".join(original_terms))
+            if identifiers:
+                # Exact identifier matches come first
+                cursor.execute(_SQL_ROWIDS_BY_NAME, (orjson.dumps(identifiers).decode(), limit))
+                rowids.update(dict.fromkeys(r[0] for r in cursor.fetchall()))
 
-            for fts_query in fts_strategies:
-                if len(results_map) >= limit:
+            for stage in ("phrase", "and", "or"):
+                if len(rowids) >= limit:
                     break
+                exprs = [strategies[stage] for strategies, _ in stages if stage in strategies]
+                if not exprs:
+                    continue
+                fts_query = " OR ".join(f"({e})" for e in exprs) if len(exprs) > 1 else exprs[0]
                     
                 try:
-                    sql = """
-                        SELECT s.*, f.rank FROM snippets s
-                        JOIN snippets_fts f ON s.rowid = f.rowid
-                        WHERE snippets_fts MATCH ?
-                        ORDER BY rank
-                        LIMIT ?
-                    """
-                    cursor.execute(sql, (fts_query, limit))
-                    for r in cursor.fetchall():
-                        results_map.setdefault(r["id"], r)
-                except sqlite3.OperationalError:
+                    cursor.execute(_SQL_FTS_ROWIDS, (fts_query, limit))
+                    rowids.update(dict.fromkeys(r[0] for r in cursor.fetchall()))
+                except sqlite3.OperationalError as e:
+                    logger.debug(f"FTS query {fts_query!r} failed: {e}")
                     continue 
 
-            if not results_map:
-                sql_like = "SELECT * FROM snippets WHERE name LIKE ? OR content LIKE ? OR summary LIKE ? LIMIT ?"
-                pattern = f"%{query}%"
-                cursor.execute(sql_like, (pattern, pattern, pattern, limit))
-                for r in cursor.fetchall():
-                    results_map.setdefault(r["id"], r)
-
-        return [self._row_to_snippet(row) for row in results_map.values()]
+            if not rowids:
+                # Substring fallback: the trigram index answers queries long enough to have trigrams,
+                # a LIKE scan only the rest (or all of them, without the index)
+                like_queries = queries
+                trigram_queries = [q for q in queries if len(q) >= TRIGRAM_MIN_CHARS]
+                if trigram_queries:
+                    try:
+                        cursor.execute(_SQL_TRIGRAM_ROWIDS, (" OR ".join(map(_fts_quote, trigram_queries)), limit))
+                        rowids.update(dict.fromkeys(r[0] for r in cursor.fetchall()))
+                        like_queries = [q for q in queries if len(q) < TRIGRAM_MIN_CHARS]
+                    except sqlite3.OperationalError as e:
+                        logger.debug(f"Trigram query failed: {e}")
+
+                if like_queries and len(rowids) < limit:
+                    like_clause = " OR ".join(["name LIKE ? OR content LIKE ? OR summary LIKE ?"] * len(like_queries))
+                    params = [p for q in like_queries for p in (f"%{q}%",) * 3]
+                    cursor.execute(f"SELECT rowid FROM snippets WHERE {like_clause} LIMIT ?", (*params, limit - len(rowids)))
+                    rowids.update(dict.fromkeys(r[0] for r in cursor.fetchall()))
+
+            ordered = list(rowids)
+            cursor.row_factory = None
+            cursor.execute(_SQL_SNIPPETS_BY_ROWID, (orjson.dumps(ordered).decode(),))
+            # row_key is the trailing column, after the snippet columns
+            rows_by_rowid: Dict[int, tuple] = {row[-1]: row[:-1] for row in cursor.fetchall()}
+
+        return [self._row_to_snippet(rows_by_rowid[r]) for r in ordered if r in rows_by_rowid]
 
     def search_by_name(self, name_query: str) -> List[CodeSnippet]:
-        with self._get_connection() as conn:
+        pattern = f"%{name_query}%"
+        with self._read_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM snippets WHERE name LIKE ?", (f"%{name_query}%",))
+            try:
+                # Same LIKE semantics, served by the trigram index when the pattern has 3+ characters
+                cursor.execute(_SQL_SNIPPETS_BY_NAME_LIKE, (pattern,))
+            except sqlite3.OperationalError:
+                cursor.execute("SELECT * FROM snippets WHERE name LIKE ?", (pattern,))
             return [self._row_to_snippet(row) for row in cursor.fetchall()]
 
+    def check_integrity(self) -> bool:
+        """
+        Maintenance check, too slow for every startup since it reads every page: verifies the database
+        file and the FTS index against the snippets table, rebuilding the index if it has drifted.
+        """
+        try:
+            with self._write_connection() as conn:
+                problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+                if problems != ["ok"]:
+                    logger.error(f"Database corruption detected: {'; '.join(problems[:10])}")
+                    return False
+                try:
+                    conn.execute("INSERT INTO snippets_fts(snippets_fts, rank) VALUES('integrity-check', 1)")
+                except sqlite3.DatabaseError as e:
+                    logger.warning(f"FTS index out of sync ({e}). Rebuilding...")
+                    conn.execute("INSERT INTO snippets_fts(snippets_fts) VALUES('rebuild')")
+                # The check is issued as an INSERT, which opens a transaction either way
+                conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Integrity check failed: {e}")
+            return False
+
     def _rebuild_fts_index(self):
         """Helper to force a rebuild of the FTS index."""
         try:
-            with self._get_connection() as conn:
+            with self._write_connection() as conn:
                 conn.execute("INSERT INTO snippets_fts(snippets_fts) VALUES('rebuild')")
                 conn.commit()
         except Exception as e: